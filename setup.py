@@ -24,9 +24,20 @@ from skbuild import setup
 
 setup(
     packages=find_packages(),
+    package_data={"solid.config": ["*.yaml"]},
     cmake_install_dir="pybind/",
     cmake_install_target="install_python_bindings",
-    entry_points={"console_scripts": ["solid_pipeline=solid.tools.cmd:run"]},
+    entry_points={
+        "console_scripts": [
+            "solid_pipeline=solid.tools.cmd:run",
+            "solid_benchmark=solid.tools.benchmark:run",
+            "solid_batch=solid.tools.batch:run",
+            "solid_sweep=solid.tools.sweep:run",
+            "solid_pack=solid.tools.pack:run",
+            "solid_map=solid.tools.descriptor_map:run",
+            "solid_matrix=solid.tools.distance_matrix:run",
+        ]
+    },
     install_requires=[
         "numpy",
         "typer[all]>=0.6.0",
@@ -39,7 +39,27 @@ class SolidConfig(BaseModel):
     num_elevation: int = 64
     num_range: int = 40
     voxel_size: float = 0.5
+    chunk_size: Optional[int] = None
     loop_threshold: float = 0.004
+    exclusion_frames: int = 100
+    exclusion_seconds: Optional[float] = None
+    top_k: Optional[int] = None
+    index: str = "exact"
+    ivf_lists: int = 64
+    ivf_probes: int = 8
+    ivf_train_size: int = 1000
+    projection_dims: int = 8
+    projection_method: str = "pca"
+    projection_train_size: int = 1000
+    shortlist_size: int = 256
+    descriptor_dtype: str = "float64"
+    max_database_scans: Optional[int] = None
+    max_database_bytes: Optional[int] = None
+    eviction_policy: str = "oldest"
+    keyframe_distance: Optional[float] = None
+    keyframe_min_frames: int = 1
+    yaw_mode: str = "l1"
+    max_yaw_candidates: Optional[int] = None
 
 
 def load_config(config_file: Optional[Path]) -> SolidConfig:
@@ -0,0 +1,200 @@
+import numpy as np
+
+from solid.core.index import BruteForceIndex, top_k_smallest
+from solid.core.quantization import QuantizedArray
+
+
+class SolidDatabase:
+    """R-SOLiD/A-SOLiD descriptors stored row-wise in preallocated arrays that grow on demand.
+
+    R-SOLiD rows are kept L2-normalized so cosine distances against the whole database reduce to a
+    single matrix-vector product. Retrieval goes through a pluggable index, exhaustive by default.
+    With a float16 or int8 dtype the rows are stored as QuantizedArray codes instead of float64."""
+
+    def __init__(
+        self, num_range: int, num_angle: int, capacity: int = 1024, index=None, dtype="float64"
+    ):
+        self.index = index if index is not None else BruteForceIndex()
+        self.dtype = dtype
+        self._rsolid = self._empty(max(capacity, 1), num_range)
+        self._asolid = self._empty(max(capacity, 1), num_angle)
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    @property
+    def capacity(self):
+        return self._rsolid.shape[0]
+
+    @property
+    def rsolid(self):
+        return self._rsolid[: self._size]
+
+    @property
+    def asolid(self):
+        return self._asolid[: self._size]
+
+    @property
+    def nbytes(self):
+        return self.rsolid.nbytes + self.asolid.nbytes
+
+    def _empty(self, capacity: int, dim: int):
+        if self.dtype == "float64":
+            return np.empty((capacity, dim))
+        return QuantizedArray.empty((capacity, dim), self.dtype)
+
+    @staticmethod
+    def normalize(r_solid):
+        return r_solid / np.linalg.norm(r_solid, axis=-1, keepdims=True)
+
+    def reserve(self, capacity: int):
+        if capacity <= self.capacity:
+            return
+        capacity = max(capacity, 2 * self.capacity)
+        for name in ("_rsolid", "_asolid"):
+            old = getattr(self, name)
+            new = self._empty(capacity, old.shape[1])
+            new[: self._size] = old[: self._size]
+            setattr(self, name, new)
+
+    def append(self, r_solid, a_solid):
+        self.extend(np.atleast_2d(r_solid), np.atleast_2d(a_solid))
+
+    def extend(self, r_solids, a_solids):
+        start, stop = self._size, self._size + len(r_solids)
+        self.reserve(stop)
+        self._rsolid[start:stop] = self.normalize(r_solids)
+        self._asolid[start:stop] = a_solids
+        self._size = stop
+        self.index.add(self.rsolid, start, stop)
+
+    def rows(self, scan_ids):
+        """Rows of rsolid/asolid that hold the given scan ids"""
+        return np.asarray(scan_ids)
+
+    def cosine_distances(self, query, num_candidates: int):
+        """Cosine distances between an R-SOLiD query and the first num_candidates entries"""
+        return 1 - self._rsolid[:num_candidates] @ self.normalize(query)
+
+    def search(self, query, num_candidates: int, k=None):
+        """Ids and cosine distances of the candidates among the first num_candidates entries that
+        the index retrieves for an R-SOLiD query, the k closest only if k is given"""
+        return self.index.search(self.rsolid, self.normalize(query), num_candidates, k)
+
+
+class LifelongDatabase(SolidDatabase):
+    """SolidDatabase bounded to max_scans entries, or as many as fit in max_bytes.
+
+    Once full, every append first evicts one entry: the oldest one, or with the "redundancy"
+    policy the one closest to another retained descriptor. The last entry is moved into the freed
+    row, so the retained descriptors stay contiguous, while search keeps returning the original
+    scan ids. Retrieval is always exhaustive over the retained entries, so its cost stops growing
+    with the database."""
+
+    POLICIES = ("oldest", "redundancy")
+
+    def __init__(
+        self,
+        num_range: int,
+        num_angle: int,
+        max_scans=None,
+        max_bytes=None,
+        policy: str = "oldest",
+        dtype="float64",
+    ):
+        if policy not in self.POLICIES:
+            raise ValueError(f"Unknown eviction policy '{policy}', use one of {self.POLICIES}")
+        if max_scans is None and max_bytes is None:
+            raise ValueError("A lifelong database needs max_scans or max_bytes")
+        super().__init__(num_range, num_angle, capacity=1, dtype=dtype)
+        # Bytes of one entry: descriptors plus scan id and redundancy bookkeeping
+        row_bytes = self._rsolid[:1].nbytes + self._asolid[:1].nbytes + 3 * 8
+        max_rows = [limit for limit in (max_scans, max_bytes and max_bytes // row_bytes) if limit]
+        self.max_scans = max(min(max_rows), 1)
+        self.policy = policy
+        self.reserve(self.max_scans)
+
+        self._scan_ids = np.empty(self.max_scans, dtype=np.int64)
+        self._nn_dist = np.empty(self.max_scans)
+        self._nn_row = np.empty(self.max_scans, dtype=np.int64)
+        self._row_of = {}
+        self._next_id = 0
+        self.evicted = 0
+
+    @property
+    def scan_ids(self):
+        return self._scan_ids[: self._size]
+
+    def extend(self, r_solids, a_solids):
+        for r_solid, a_solid in zip(r_solids, a_solids):
+            if self._size == self.max_scans:
+                self._evict()
+            self._insert(r_solid, a_solid)
+
+    def _insert(self, r_solid, a_solid):
+        row = self._size
+        self._rsolid[row : row + 1] = self.normalize(np.atleast_2d(r_solid))
+        self._asolid[row : row + 1] = np.atleast_2d(a_solid)
+        distances = 1 - self._rsolid[:row] @ self._rsolid[row]
+        closer = distances < self._nn_dist[:row]
+        self._nn_dist[:row][closer] = distances[closer]
+        self._nn_row[:row][closer] = row
+        self._nn_dist[row] = distances.min() if row else np.inf
+        self._nn_row[row] = np.argmin(distances) if row else -1
+
+        self._scan_ids[row] = self._next_id
+        self._row_of[self._next_id] = row
+        self._next_id += 1
+        self._size += 1
+
+    def _evict(self):
+        if self.policy == "oldest":
+            victim = int(np.argmin(self.scan_ids))
+        else:
+            victim = int(np.argmin(self._nn_dist[: self._size]))
+        last = self._size - 1
+        del self._row_of[int(self._scan_ids[victim])]
+        if victim != last:
+            # Move the last entry into the freed row
+            self._rsolid[victim : victim + 1] = self._rsolid[last : last + 1]
+            self._asolid[victim : victim + 1] = self._asolid[last : last + 1]
+            for array in (self._scan_ids, self._nn_dist, self._nn_row):
+                array[victim] = array[last]
+            self._row_of[int(self._scan_ids[victim])] = victim
+        self._size = last
+        self.evicted += 1
+
+        nn_row = self._nn_row[: self._size]
+        orphans = np.flatnonzero(nn_row == victim)
+        nn_row[nn_row == last] = victim
+        # Entries whose nearest neighbour was evicted need a new one
+        for row in orphans:
+            distances = 1 - self.rsolid @ self._rsolid[row]
+            distances[row] = np.inf
+            self._nn_dist[row] = distances.min() if self._size > 1 else np.inf
+            self._nn_row[row] = np.argmin(distances) if self._size > 1 else -1
+
+    def rows(self, scan_ids):
+        scan_ids = np.asarray(scan_ids)
+        rows = [self._row_of[int(scan_id)] for scan_id in scan_ids.ravel()]
+        return np.array(rows, dtype=np.int64).reshape(scan_ids.shape)
+
+    def cosine_distances(self, query, num_candidates: int):
+        """Cosine distances to the scan ids below num_candidates, inf for the evicted ones"""
+        distances = np.full(num_candidates, np.inf)
+        ids, retained = self.search(query, num_candidates)
+        distances[ids] = retained
+        return distances
+
+    def search(self, query, num_candidates: int, k=None):
+        """Scan ids and cosine distances of the retained entries with a scan id below
+        num_candidates, the k closest only if k is given"""
+        eligible = np.flatnonzero(self.scan_ids < num_candidates)
+        eligible = eligible[np.argsort(self.scan_ids[eligible], kind="stable")]
+        distances = 1 - self._rsolid[: self._size][eligible] @ self.normalize(query)
+        ids = self.scan_ids[eligible]
+        if k is not None:
+            best = top_k_smallest(distances, k)
+            ids, distances = ids[best], distances[best]
+        return ids, distances
@@ -0,0 +1,18 @@
+import numpy as np
+
+
+def num_candidates(query_idx, exclusion_frames: int, exclusion_seconds=None, times=None, first=0):
+    """Number of scans old enough to be loop candidates of scan query_idx, or of every scan of an
+    array of them: more than exclusion_frames frames older and, with exclusion_seconds, at least
+    that many seconds older.
+
+    times holds the timestamps in seconds of scans first up to query_idx. They are monotonic, so
+    the candidates are always a prefix of the sequence, and scans before first must be known to
+    be old enough."""
+    query_idx = np.asarray(query_idx)
+    count = query_idx - exclusion_frames
+    if exclusion_seconds is not None:
+        times = np.asarray(times)
+        horizons = times[query_idx - first] - exclusion_seconds
+        count = np.minimum(count, first + np.searchsorted(times, horizons, side="right"))
+    return np.maximum(count, 0)
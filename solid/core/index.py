@@ -0,0 +1,173 @@
+import numpy as np
+
+
+def top_k_smallest(distances, k):
+    """Positions of the k smallest distances, best first, without sorting the whole array"""
+    if k is None or k >= len(distances):
+        return np.argsort(distances, kind="stable")
+    best = np.argpartition(distances, k - 1)[:k]
+    return best[np.argsort(distances[best], kind="stable")]
+
+
+class BruteForceIndex:
+    """Exact search: compares the query with every eligible database entry"""
+
+    def add(self, rsolid, start: int, stop: int):
+        pass
+
+    def search(self, rsolid, query, num_candidates: int, k=None):
+        distances = 1 - rsolid[:num_candidates] @ query
+        ids = np.arange(len(distances))
+        if k is not None:
+            best = top_k_smallest(distances, k)
+            ids, distances = ids[best], distances[best]
+        return ids, distances
+
+
+class IVFIndex:
+    """Inverted-file index over the normalized R-SOLiD vectors.
+
+    Once `train_size` entries are inserted, they are clustered with spherical k-means into
+    `num_lists` cells and every entry is filed under its closest centroid. A query is only compared
+    with the entries of its `num_probes` closest cells: more probes trade speed for recall. While
+    fewer than `train_size` entries are eligible the search is exhaustive, so results do not
+    depend on whether later entries were already inserted when the index was trained."""
+
+    def __init__(self, num_lists: int = 64, num_probes: int = 8, train_size: int = 1000):
+        self.num_lists = num_lists
+        self.num_probes = num_probes
+        self.train_size = max(train_size, num_lists)
+        self.centroids = None
+        self._lists = [np.empty(16, dtype=np.int64) for _ in range(num_lists)]
+        self._list_sizes = np.zeros(num_lists, dtype=np.int64)
+
+    @property
+    def is_trained(self):
+        return self.centroids is not None
+
+    def train(self, vectors, iterations: int = 10, seed: int = 0):
+        vectors = np.asarray(vectors, dtype=np.float64)
+        rng = np.random.default_rng(seed)
+        centroids = vectors[rng.choice(len(vectors), self.num_lists, replace=False)]
+        for _ in range(iterations):
+            assignment = np.argmax(vectors @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignment, vectors)
+            norms = np.linalg.norm(sums, axis=1, keepdims=True)
+            # Cells that lost all their members keep their previous centroid
+            centroids = np.where(norms > 0, sums / np.where(norms > 0, norms, 1), centroids)
+        self.centroids = centroids
+
+    def _file(self, ids, vectors):
+        assignment = np.argmax(vectors @ self.centroids.T, axis=1)
+        for cell in np.unique(assignment):
+            cell_ids = ids[assignment == cell]
+            size = self._list_sizes[cell]
+            if size + len(cell_ids) > len(self._lists[cell]):
+                grown = np.empty(max(2 * len(self._lists[cell]), size + len(cell_ids)), np.int64)
+                grown[:size] = self._lists[cell][:size]
+                self._lists[cell] = grown
+            self._lists[cell][size : size + len(cell_ids)] = cell_ids
+            self._list_sizes[cell] += len(cell_ids)
+
+    def add(self, rsolid, start: int, stop: int):
+        if not self.is_trained:
+            if stop < self.train_size:
+                return
+            # Always the first train_size entries, however the inserts were batched
+            self.train(rsolid[: self.train_size])
+            start = 0
+        self._file(np.arange(start, stop), rsolid[start:stop])
+
+    def search(self, rsolid, query, num_candidates: int, k=None):
+        if not self.is_trained or num_candidates < self.train_size:
+            return BruteForceIndex().search(rsolid, query, num_candidates, k)
+
+        probes = top_k_smallest(-(self.centroids @ query), self.num_probes)
+        candidates = []
+        for cell in probes:
+            cell_ids = self._lists[cell][: self._list_sizes[cell]]
+            # Ids are filed in insertion order, so the eligible ones are a prefix of every list
+            candidates.append(cell_ids[: np.searchsorted(cell_ids, num_candidates)])
+        ids = np.sort(np.concatenate(candidates))
+        distances = 1 - rsolid[ids] @ query
+        if k is not None:
+            best = top_k_smallest(distances, k)
+            ids, distances = ids[best], distances[best]
+        return ids, distances
+
+
+class ProjectionIndex:
+    """Two-stage retrieval on a compressed R-SOLiD signature.
+
+    Once `train_size` entries are inserted, a `dims`-dimensional projection is fit: the leading
+    right singular vectors of the entries ("pca") or a Gaussian random projection ("random").
+    A query first ranks every eligible entry by the dot product of the projected signatures,
+    then re-ranks the `shortlist` best ones with the exact cosine distance. While fewer than
+    `train_size` entries are eligible the search is exhaustive."""
+
+    def __init__(
+        self, dims: int = 8, shortlist: int = 256, train_size: int = 1000, method: str = "pca"
+    ):
+        if method not in ("pca", "random"):
+            raise ValueError(f"Unknown projection '{method}', use 'pca' or 'random'")
+        self.dims = dims
+        self.shortlist = shortlist
+        self.train_size = max(train_size, dims)
+        self.method = method
+        self.projection = None
+        self._signatures = np.empty((0, dims), dtype=np.float32)
+
+    @property
+    def is_trained(self):
+        return self.projection is not None
+
+    def train(self, vectors, seed: int = 0):
+        vectors = np.asarray(vectors, dtype=np.float64)
+        if self.method == "pca":
+            # Uncentered, so that signature dot products approximate the cosine similarities
+            self.projection = np.linalg.svd(vectors, full_matrices=False)[2][: self.dims].T
+        else:
+            rng = np.random.default_rng(seed)
+            self.projection = rng.normal(size=(vectors.shape[1], self.dims)) / np.sqrt(self.dims)
+
+    def add(self, rsolid, start: int, stop: int):
+        if not self.is_trained:
+            if stop < self.train_size:
+                return
+            # Always the first train_size entries, however the inserts were batched
+            self.train(rsolid[: self.train_size])
+            start = 0
+        if stop > len(self._signatures):
+            grown = np.empty((max(2 * len(self._signatures), stop), self.dims), np.float32)
+            grown[:start] = self._signatures[:start]
+            self._signatures = grown
+        self._signatures[start:stop] = rsolid[start:stop] @ self.projection
+
+    def search(self, rsolid, query, num_candidates: int, k=None):
+        if not self.is_trained or num_candidates < max(self.train_size, self.shortlist + 1):
+            return BruteForceIndex().search(rsolid, query, num_candidates, k)
+
+        query_signature = (query @ self.projection).astype(np.float32)
+        similarities = self._signatures[:num_candidates] @ query_signature
+        ids = np.sort(top_k_smallest(-similarities, self.shortlist))
+        distances = 1 - rsolid[ids] @ query
+        if k is not None:
+            best = top_k_smallest(distances, k)
+            ids, distances = ids[best], distances[best]
+        return ids, distances
+
+
+def make_index(config):
+    if config.index == "exact":
+        return BruteForceIndex()
+    if config.index == "ivf":
+        return IVFIndex(config.ivf_lists, config.ivf_probes, config.ivf_train_size)
+    if config.index == "projection":
+        return ProjectionIndex(
+            config.projection_dims,
+            config.shortlist_size,
+            config.projection_train_size,
+            config.projection_method,
+        )
+    raise ValueError(f"Unknown index '{config.index}', use 'exact', 'ivf' or 'projection'")
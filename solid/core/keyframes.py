@@ -0,0 +1,48 @@
+import numpy as np
+
+
+class KeyframeGate:
+    """Decides which scans are inserted in the database.
+
+    A scan becomes a keyframe unless it was taken less than min_frames frames after the last
+    keyframe, or its R-SOLiD is closer than max_distance in cosine distance to the one of the last
+    keyframe, e.g. while the vehicle is stopped. keyframe_ids maps database rows to scan ids."""
+
+    def __init__(self, max_distance=None, min_frames: int = 1, capacity: int = 1024):
+        self.max_distance = max_distance
+        self.min_frames = min_frames
+        self._keyframe_ids = np.empty(max(capacity, 1), dtype=np.int64)
+        self._size = 0
+        self._last_rsolid = None
+        self.num_scans = 0
+
+    @property
+    def enabled(self):
+        return self.max_distance is not None or self.min_frames > 1
+
+    @property
+    def keyframe_ids(self):
+        return self._keyframe_ids[: self._size]
+
+    def __len__(self):
+        return self._size
+
+    def admit(self, scan_idx: int, r_solid) -> bool:
+        self.num_scans += 1
+        r_solid = r_solid / np.linalg.norm(r_solid)
+        if self._size:
+            if scan_idx - self._keyframe_ids[self._size - 1] < self.min_frames:
+                return False
+            if self.max_distance is not None:
+                if 1 - r_solid @ self._last_rsolid < self.max_distance:
+                    return False
+        if self._size == len(self._keyframe_ids):
+            self._keyframe_ids = np.resize(self._keyframe_ids, 2 * self._size)
+        self._keyframe_ids[self._size] = scan_idx
+        self._size += 1
+        self._last_rsolid = r_solid
+        return True
+
+    def num_candidates(self, max_scan_idx: int) -> int:
+        """Number of keyframes, i.e. database rows, taken before scan max_scan_idx"""
+        return int(np.searchsorted(self.keyframe_ids, max_scan_idx))
@@ -1,5 +1,4 @@
 import numpy as np
-import open3d as o3d
 from pydantic_settings import BaseSettings
 
 class PointModule:
@@ -19,9 +18,30 @@ class PointModule:
         return cloud_out
 
     def down_sampling(self, points):
-        pcd = o3d.geometry.PointCloud()
-        pcd.points = o3d.utility.Vector3dVector(points[:, 0:3])
-        down_pcd = pcd.voxel_down_sample(voxel_size=self.voxel_size)
-        down_points_np = np.asarray(down_pcd.points)
-        return down_points_np
+        points = points[:, 0:3]
+        if len(points) == 0:
+            return np.empty((0, 3))
 
+        # Same voxel grid as open3d's voxel_down_sample: anchored half a voxel below the min bound
+        voxel_min_bound = points.min(axis=0) - self.voxel_size*0.5
+        voxel_indices = np.floor((points - voxel_min_bound) / self.voxel_size).astype(np.int64)
+        grid_shape = voxel_indices.max(axis=0) + 1
+        voxel_keys = np.ravel_multi_index(voxel_indices.T, grid_shape)
+
+        _, voxel_ids, num_points = np.unique(voxel_keys, return_inverse=True, return_counts=True)
+        voxel_ids = voxel_ids.reshape(-1)
+        centroids = np.empty((len(num_points), 3))
+        for axis in range(3):
+            centroids[:, axis] = np.bincount(voxel_ids, weights=points[:, axis]) / num_points
+        return centroids
+
+    def range_filter(self, points):
+        # remove_closest_points and remove_far_points on a single squared norm
+        dists = np.sum(np.square(points[:, :3]), axis=1)
+        in_range = (dists > self.min_distance*self.min_distance) & (
+            dists < self.max_distance*self.max_distance
+        )
+        return points[in_range]
+
+    def filter_and_down_sampling(self, points):
+        return self.down_sampling(self.range_filter(points))
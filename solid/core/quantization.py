@@ -0,0 +1,68 @@
+import numpy as np
+
+DESCRIPTOR_DTYPES = ("float64", "float16", "int8")
+
+
+class QuantizedArray:
+    """2D array of float16 or int8 codes with one float64 scale per row.
+
+    Slices are views of the codes; any other index dequantizes the selected rows. Products with
+    a vector or a matrix run on float32 blocks dequantized in bulk, so the full precision rows are
+    never materialized."""
+
+    _CODE_MAX = {"float16": 1.0, "int8": 127.0}
+
+    def __init__(self, codes, scales):
+        self.codes = codes
+        self.scales = scales
+
+    @classmethod
+    def empty(cls, shape, dtype: str):
+        if dtype not in cls._CODE_MAX:
+            raise ValueError(f"Unknown descriptor dtype '{dtype}', use one of {DESCRIPTOR_DTYPES}")
+        return cls(np.empty(shape, dtype=dtype), np.empty(shape[0]))
+
+    @property
+    def dtype(self):
+        return self.codes.dtype
+
+    @property
+    def shape(self):
+        return self.codes.shape
+
+    @property
+    def nbytes(self):
+        return self.codes.nbytes + self.scales.nbytes
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            return QuantizedArray(self.codes[key], self.scales[key])
+        return self.codes[key].astype(np.float64) * self.scales[key][..., None]
+
+    def __setitem__(self, key, values):
+        if isinstance(values, QuantizedArray):
+            self.codes[key], self.scales[key] = values.codes, values.scales
+            return
+        values = np.atleast_2d(values)
+        max_values = np.max(np.abs(values), axis=1)
+        scales = np.where(max_values > 0, max_values, 1.0) / self._CODE_MAX[self.dtype.name]
+        codes = values / scales[:, None]
+        if self.dtype == np.int8:
+            codes = np.rint(codes)
+        self.codes[key], self.scales[key] = codes, scales
+
+    def __array__(self, dtype=None, copy=None):
+        values = self[np.arange(len(self))]
+        return values if dtype is None else values.astype(dtype)
+
+    def __matmul__(self, other, block_size: int = 65536):
+        other = np.asarray(other, dtype=np.float32)
+        result = np.empty((len(self),) + other.shape[1:])
+        for start in range(0, len(self), block_size):
+            block = slice(start, start + block_size)
+            products = self.codes[block].astype(np.float32) @ other
+            result[block] = products * self.scales[block].reshape((-1,) + (1,) * (other.ndim - 1))
+        return result
@@ -47,7 +47,81 @@ class SOLiDModule:
 
         return int(idx_ring), int(idx_sector), int(idx_height)
 
+    def polar_coordinates(self, points):
+        x = points[:, 0]
+        y = points[:, 1]
+        z = points[:, 2]
+
+        x = np.where(x == 0.0, 0.001, x)
+        y = np.where(y == 0.0, 0.001, y)
+
+        # |y|/|x| is exactly the arctan argument of every quadrant in xy2theta
+        alpha = (180/np.pi) * np.arctan(np.abs(y) / np.abs(x))
+        theta = np.where(
+            x >= 0,
+            np.where(y >= 0, alpha, 360 - alpha),
+            np.where(y >= 0, 180 - alpha, 180 + alpha),
+        )
+        faraway = np.sqrt(x*x + y*y)
+        elevation = np.rad2deg(np.arctan2(z, faraway))
+        return theta, faraway, elevation
+
+    def polar_to_bins(self, theta, faraway, elevation):
+        # Only this step depends on the bin counts and the field of view
+        phi = elevation - self.fov_d
+
+        gap_ring = self.max_length/self.num_range
+        gap_sector = 360/self.num_angle
+        gap_height = ((self.fov_u-self.fov_d))/self.num_elevation
+
+        idx_ring = np.minimum(np.floor_divide(faraway, gap_ring), self.num_range-1)
+        idx_sector = np.floor_divide(theta, gap_sector)
+        idx_height = np.minimum(np.floor_divide(phi, gap_height), self.num_elevation-1)
+
+        return idx_ring.astype(np.int64), idx_sector.astype(np.int64), idx_height.astype(np.int64)
+
+    def points_to_bins(self, points):
+        return self.polar_to_bins(*self.polar_coordinates(points))
+
+    def bins2counters(self, idx_ring, idx_sector, idx_height):
+        # Heights below fov_d wrap around exactly like the negative indices did in pt2rah
+        idx_height = np.where(idx_height < 0, idx_height + self.num_elevation, idx_height)
+
+        rh_shape = (self.num_range, self.num_elevation)
+        sh_shape = (self.num_angle, self.num_elevation)
+        rh_counter = np.bincount(
+            np.ravel_multi_index((idx_ring, idx_height), rh_shape), minlength=np.prod(rh_shape)
+        )
+        sh_counter = np.bincount(
+            np.ravel_multi_index((idx_sector, idx_height), sh_shape), minlength=np.prod(sh_shape)
+        )
+        return (
+            rh_counter.reshape(rh_shape).astype(np.float64),
+            sh_counter.reshape(sh_shape).astype(np.float64),
+        )
+
+    def counters2solid(self, rh_counter, sh_counter):
+        ring_matrix = rh_counter
+        sector_matrix = sh_counter
+        number_vector = np.sum(ring_matrix, axis=0)
+        min_val = number_vector.min()
+        max_val = number_vector.max()
+        number_vector = (number_vector - min_val) / (max_val - min_val)
+
+        r_solid = ring_matrix.dot(number_vector)
+        a_solid = sector_matrix.dot(number_vector)
+
+        return r_solid, a_solid
+
+    def polar2solid(self, theta, faraway, elevation):
+        rh_counter, sh_counter = self.bins2counters(*self.polar_to_bins(theta, faraway, elevation))
+        return self.counters2solid(rh_counter, sh_counter)
+
     def ptcloud2solid(self, ptcloud):
+        rh_counter, sh_counter = self.bins2counters(*self.points_to_bins(ptcloud))
+        return self.counters2solid(rh_counter, sh_counter)
+
+    def ptcloud2solid_pointwise(self, ptcloud):
         num_points = ptcloud.shape[0]               
         
         gap_ring = self.max_length/self.num_range            
@@ -62,17 +136,7 @@ class SOLiDModule:
             rh_counter[idx_ring, idx_height] = rh_counter[idx_ring, idx_height] + 1     
             sh_counter[idx_sector, idx_height] = sh_counter[idx_sector, idx_height] + 1  
      
-        ring_matrix = rh_counter    
-        sector_matrix = sh_counter
-        number_vector = np.sum(ring_matrix, axis=0)
-        min_val = number_vector.min()
-        max_val = number_vector.max()
-        number_vector = (number_vector - min_val) / (max_val - min_val)
-            
-        r_solid = ring_matrix.dot(number_vector)
-        a_solid = sector_matrix.dot(number_vector)
-                
-        return r_solid, a_solid
+        return self.counters2solid(rh_counter, sh_counter)
 
     def get_descriptor(self, scan):
         r_solid, a_solid = self.ptcloud2solid(scan)
@@ -88,4 +152,25 @@ class SOLiDModule:
             initial_cosine_similarity = np.sum(np.abs(candidate - np.roll(query, shift_index)))
             initial_cosdist.append(initial_cosine_similarity)
         angle_difference = (np.argmin(initial_cosdist))*(360/self.num_angle)
-        return angle_difference
\ No newline at end of file
+        return angle_difference
+
+    def circulant(self, query):
+        # Row s holds np.roll(query, s)
+        num_shifts = len(query)
+        shifts = np.arange(num_shifts)
+        return query[(shifts[None, :] - shifts[:, None]) % num_shifts]
+
+    def pose_estimation_batch(self, query, candidates, mode="l1"):
+        candidates = np.atleast_2d(candidates)
+        if mode == "l1":
+            scores = np.sum(np.abs(candidates[:, None, :] - self.circulant(query)[None]), axis=2)
+        elif mode == "fft":
+            # The L2 distance to np.roll(query, s) is smallest where the circular
+            # cross-correlation between candidate and query is largest
+            num_shifts = len(query)
+            spectrum = np.fft.rfft(candidates, axis=1) * np.conj(np.fft.rfft(query))
+            scores = -np.fft.irfft(spectrum, n=num_shifts, axis=1)
+        else:
+            raise ValueError(f"Unknown yaw estimation mode '{mode}', use 'l1' or 'fft'")
+        angle_differences = np.argmin(scores, axis=1)*(360/self.num_angle)
+        return angle_differences
@@ -0,0 +1,94 @@
+import numpy as np
+
+from solid.core.point_module import PointModule
+from solid.core.solid import SOLiDModule
+
+
+class StreamingDescriptor:
+    """Builds the R-SOLiD/A-SOLiD of a scan from chunks of points, e.g. float32 views into a file.
+
+    Same result as range_filter, down_sampling and ptcloud2solid on the whole scan, without ever
+    holding the scan as one float64 array. The voxel grid is anchored at the minimum bound of the
+    scan, so the chunks are read twice: `bound` collects the bounds, then `add` accumulates the
+    per-voxel sums in scan order. `finalize` bins the voxel centroids into the histograms.
+    chunk_size is the number of points per chunk to request from dataloaders."""
+
+    def __init__(self, preprocess: PointModule, solid: SOLiDModule, chunk_size: int = 1 << 18):
+        self.preprocess = preprocess
+        self.solid = solid
+        self.chunk_size = chunk_size
+        self.reset()
+
+    def reset(self):
+        self._min_bound = np.full(3, np.inf)
+        self._max_bound = np.full(3, -np.inf)
+        self._keys = np.empty(0, dtype=np.int64)
+        self._slots = np.empty(0, dtype=np.int64)
+        self._sums = np.zeros((1024, 3))
+        self._counts = np.zeros(1024, dtype=np.int64)
+
+    @property
+    def num_voxels(self):
+        return len(self._keys)
+
+    def _filter(self, chunk):
+        return self.preprocess.range_filter(np.asarray(chunk[:, :3], dtype=np.float64))
+
+    def bound(self, chunk):
+        points = self._filter(chunk)
+        if len(points):
+            self._min_bound = np.minimum(self._min_bound, points.min(axis=0))
+            self._max_bound = np.maximum(self._max_bound, points.max(axis=0))
+
+    def _voxel_keys(self, points):
+        voxel_size = self.preprocess.voxel_size
+        # Same voxel grid as PointModule.down_sampling
+        voxel_min_bound = self._min_bound - voxel_size*0.5
+        grid_shape = np.floor((self._max_bound - voxel_min_bound) / voxel_size).astype(np.int64) + 1
+        voxel_indices = np.floor((points - voxel_min_bound) / voxel_size).astype(np.int64)
+        return np.ravel_multi_index(voxel_indices.T, grid_shape)
+
+    def _voxel_slots(self, keys):
+        # Voxels get a slot the first time a chunk hits them; _keys stays sorted for the lookup
+        chunk_keys, inverse = np.unique(keys, return_inverse=True)
+        positions = np.searchsorted(self._keys, chunk_keys)
+        known = positions < len(self._keys)
+        known[known] = self._keys[positions[known]] == chunk_keys[known]
+        slots = np.empty(len(chunk_keys), dtype=np.int64)
+        slots[known] = self._slots[positions[known]]
+        slots[~known] = np.arange(len(self._keys), len(self._keys) + np.count_nonzero(~known))
+
+        keys = np.concatenate([self._keys, chunk_keys[~known]])
+        order = np.argsort(keys, kind="stable")
+        self._keys = keys[order]
+        self._slots = np.concatenate([self._slots, slots[~known]])[order]
+        if len(self._keys) > len(self._counts):
+            capacity = max(2 * len(self._counts), len(self._keys))
+            self._sums = np.concatenate([self._sums, np.zeros((capacity - len(self._sums), 3))])
+            self._counts = np.concatenate(
+                [self._counts, np.zeros(capacity - len(self._counts), dtype=np.int64)]
+            )
+        return slots[inverse.reshape(-1)]
+
+    def add(self, chunk):
+        points = self._filter(chunk)
+        if len(points) == 0:
+            return
+        slots = self._voxel_slots(self._voxel_keys(points))
+        # Unbuffered, in point order: the same additions as down_sampling's bincount
+        np.add.at(self._sums, slots, points)
+        self._counts[: self.num_voxels] += np.bincount(slots, minlength=self.num_voxels)
+
+    def finalize(self):
+        num_voxels = self.num_voxels
+        centroids = self._sums[:num_voxels] / self._counts[:num_voxels, None]
+        return self.solid.ptcloud2solid(centroids)
+
+    def build(self, chunks):
+        """Descriptor of the scan made of chunks, a sequence that can be iterated twice"""
+        self.reset()
+        for chunk in chunks:
+            self.bound(chunk)
+        for chunk in chunks:
+            self.add(chunk)
+        return self.finalize()
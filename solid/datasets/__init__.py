@@ -51,11 +51,40 @@ def dataloader_types() -> Dict:
     return _types
 
 
-def dataset_factory(dataloader: str, data_dir: Path, *args, **kwargs):
+def scan_times(dataset):
+    """Timestamps of the scans in seconds, None unless the dataloader exposes `timestamps` and
+    their `timestamp_scale`, the duration of one timestamp unit in seconds"""
+    import numpy as np
+
+    timestamps = getattr(dataset, "timestamps", None)
+    timestamp_scale = getattr(dataset, "timestamp_scale", None)
+    if timestamps is None or timestamp_scale is None:
+        return None
+    return np.asarray(timestamps, dtype=np.float64) * timestamp_scale
+
+
+def dataset_factory(dataloader: str, data_dir: Path, *args, prefetch: int = 0, **kwargs):
     import importlib
+    import os
+
+    from solid.datasets.packed import PackedDataset, packed_archive_path
+    from solid.tools.descriptor_cache import scan_fingerprints
 
     dataloader_type = dataloader_types()[dataloader]
     module = importlib.import_module(f".{dataloader}", __name__)
     assert hasattr(module, dataloader_type), f"{dataloader_type} is not defined in {module}"
-    dataset = getattr(module, dataloader_type)
-    return dataset(data_dir=data_dir, *args, **kwargs)
+    dataset = getattr(module, dataloader_type)(data_dir=data_dir, *args, **kwargs)
+
+    # Prefer the packed archive of the sequence, see solid_pack, unless the scans changed since
+    archive = packed_archive_path(data_dir, kwargs.get("sequence"))
+    if dataloader != "packed" and os.path.exists(archive):
+        packed = PackedDataset(archive)
+        if packed.fingerprints == scan_fingerprints(dataset):
+            dataset = packed
+        else:
+            print(f"[WARNING] {archive} is out of date, reading the scans instead. Run solid_pack")
+    if prefetch > 0:
+        from solid.tools.prefetch import PrefetchDataset
+
+        dataset = PrefetchDataset(dataset, depth=prefetch)
+    return dataset
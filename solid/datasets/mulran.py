@@ -48,6 +48,15 @@ class MulranDataset:
     def __getitem__(self, idx):
         return self.read_point_cloud(self.scan_files[idx])
 
+    def scan_chunks(self, idx, chunk_size: int):
+        """float32 views of chunk_size points each, straight into the memory-mapped scan file"""
+        if os.path.getsize(self.scan_files[idx]) == 0:
+            # np.memmap cannot map an empty file
+            return [np.empty((0, 3), dtype=np.float32)]
+        points = np.memmap(self.scan_files[idx], dtype=np.float32, mode="r").reshape((-1, 4))
+        starts = range(0, len(points), chunk_size)
+        return [points[start : start + chunk_size, :3] for start in starts]
+
     def read_point_cloud(self, file_path: str):
         points = np.fromfile(file_path, dtype=np.float32).reshape((-1, 4))[:, :3]
         return points.astype(np.float64)
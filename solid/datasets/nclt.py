@@ -30,6 +30,9 @@ import numpy as np
 class NCLTDataset:
     """Adapted from PyLidar-SLAM"""
 
+    # Scan timestamps are in microseconds
+    timestamp_scale = 1e-6
+
     def __init__(self, data_dir: Path, *_, **__):
         self.sequence_id = os.path.basename(data_dir)
         self.data_dir = os.path.join(os.path.realpath(data_dir), "")
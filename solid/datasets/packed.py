@@ -0,0 +1,143 @@
+# MIT License
+#
+# Copyright (c) 2023 Saurabh Gupta, Ignacio Vizzo, Tiziano Guadagnino, Benedikt Mersch,
+# Cyrill Stachniss.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+import json
+import os
+import struct
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+
+PACKED_MAGIC = b"SOLIDPK1"
+PACKED_VERSION = 1
+# Footer position, footer length, magic
+_TRAILER = struct.Struct("<QQ8s")
+
+
+class PackedDataset:
+    """Serves the scans of a single-file archive written by pack_dataset.
+
+    Layout: the points of every scan back to back, an int64 (num_scans, 2) table with the first
+    row and the number of points of every scan, a JSON footer with the per-scan metadata and a
+    fixed-size trailer pointing at the footer. Scans are zero-copy views into a memory map."""
+
+    def __init__(self, data_dir: Path, sequence: Optional[str] = None, *_, **__):
+        self.archive = (
+            str(data_dir) if os.path.isfile(data_dir) else packed_archive_path(data_dir, sequence)
+        )
+        with open(self.archive, "rb") as archive:
+            archive.seek(-_TRAILER.size, os.SEEK_END)
+            footer_offset, footer_length, magic = _TRAILER.unpack(archive.read(_TRAILER.size))
+            if magic != PACKED_MAGIC:
+                raise ValueError(f"{self.archive} is not a packed scan archive")
+            archive.seek(footer_offset)
+            self.footer = json.loads(archive.read(footer_length))
+        if self.footer["version"] != PACKED_VERSION:
+            raise ValueError(f"Unsupported packed archive version {self.footer['version']}")
+
+        num_scans = self.footer["num_scans"]
+        self.sequence_id = self.footer["sequence_id"]
+        self.scan_files = self.footer["scan_files"]
+        self.fingerprints = [tuple(fingerprint) for fingerprint in self.footer["fingerprints"]]
+        if self.footer["timestamps"] is not None:
+            self.timestamps = np.asarray(self.footer["timestamps"], dtype=np.int64)
+        if self.footer.get("timestamp_scale") is not None:
+            self.timestamp_scale = self.footer["timestamp_scale"]
+        gt_closures = self.footer["gt_closure_indices"]
+        self.gt_closure_indices = np.asarray(gt_closures) if gt_closures is not None else None
+
+        self._index = np.memmap(
+            self.archive, np.int64, "r", offset=self.footer["index_offset"], shape=(num_scans, 2)
+        )
+        num_points = self.footer["num_points"]
+        self._points = np.memmap(
+            self.archive, np.dtype(self.footer["dtype"]), "r", shape=(max(num_points, 1), 3)
+        )[:num_points]
+
+    def __len__(self):
+        return len(self._index)
+
+    def __getitem__(self, idx):
+        start, num_points = self._index[idx]
+        return self._points[start : start + num_points]
+
+    def scan_chunks(self, idx, chunk_size: int):
+        """Views of chunk_size points each into the memory-mapped archive"""
+        start, num_points = self._index[idx]
+        stop = start + num_points
+        return [
+            self._points[first : min(first + chunk_size, stop)]
+            for first in range(start, stop, chunk_size)
+        ]
+
+
+def packed_archive_path(data_dir: Path, sequence: Optional[str] = None) -> str:
+    """Where dataset_factory looks for the packed version of a sequence"""
+    name = f"scans_{sequence}.solidpack" if sequence else "scans.solidpack"
+    return os.path.join(data_dir, name)
+
+
+def pack_dataset(dataset, filename: str, dtype: str = "float64") -> None:
+    """Writes every scan of any dataloader into one archive that PackedDataset reads back"""
+    # Lazy-loading, the cache module pulls in the configuration
+    from solid.tools.descriptor_cache import scan_fingerprints
+    from solid.tools.progress_bar import get_progress_bar
+
+    tmp_file = f"{filename}.tmp"
+    index = np.empty((len(dataset), 2), dtype=np.int64)
+    num_points = 0
+    with open(tmp_file, "wb") as archive:
+        for idx in get_progress_bar(0, len(dataset)):
+            points = np.ascontiguousarray(np.asarray(dataset[idx])[:, :3], dtype=dtype)
+            points.tofile(archive)
+            index[idx] = num_points, len(points)
+            num_points += len(points)
+        index_offset = archive.tell()
+        index.tofile(archive)
+
+        timestamps = getattr(dataset, "timestamps", None)
+        gt_closures = dataset.gt_closure_indices
+        footer = json.dumps(
+            {
+                "version": PACKED_VERSION,
+                "sequence_id": dataset.sequence_id,
+                "dtype": np.dtype(dtype).name,
+                "num_scans": len(dataset),
+                "num_points": num_points,
+                "index_offset": index_offset,
+                "scan_files": [
+                    os.path.basename(str(scan_file))
+                    for scan_file in getattr(dataset, "scan_files", range(len(dataset)))
+                ],
+                "fingerprints": scan_fingerprints(dataset),
+                "timestamps": np.asarray(timestamps).tolist() if timestamps is not None else None,
+                "timestamp_scale": getattr(dataset, "timestamp_scale", None),
+                "gt_closure_indices": (
+                    np.asarray(gt_closures).tolist() if gt_closures is not None else None
+                ),
+            }
+        ).encode()
+        footer_offset = archive.tell()
+        archive.write(footer)
+        archive.write(_TRAILER.pack(footer_offset, len(footer), PACKED_MAGIC))
+    os.replace(tmp_file, filename)
@@ -0,0 +1,154 @@
+# MIT License
+#
+# Copyright (c) 2023 Saurabh Gupta, Ignacio Vizzo, Tiziano Guadagnino, Benedikt Mersch,
+# Cyrill Stachniss.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+import time
+from collections import deque
+from typing import Dict, Optional
+
+import numpy as np
+
+from solid.config import SolidConfig
+from solid.core.database import LifelongDatabase, SolidDatabase
+from solid.core.exclusion import num_candidates
+from solid.core.index import make_index
+from solid.core.point_module import PointModule
+from solid.core.solid import SOLiDModule
+
+
+class OnlineSolid:
+    """Incremental place recognition for a live scan stream.
+
+    Every call to add_scan describes the scan, inserts it into the database and returns its loop
+    closures as rows of [candidate_idx, query_idx, angle_difference, cosine_distance], best first.
+    Candidates closer than config.exclusion_frames frames or config.exclusion_seconds seconds to
+    the query are never returned, and config.top_k bounds the number of closures per scan. The
+    timestamp of every scan, in seconds, is required with config.exclusion_seconds.
+
+    With config.max_database_scans or config.max_database_bytes set, the database is a
+    LifelongDatabase: memory and query latency stay bounded however long the stream runs, and
+    closures still refer to the index of the scan in the stream."""
+
+    def __init__(self, config: Optional[SolidConfig] = None, latency_budget: float = 0.1):
+        self.config = config if config is not None else SolidConfig()
+        self.latency_budget = latency_budget
+
+        self.solid = SOLiDModule(self.config)
+        self.preprocess = PointModule(self.config)
+        if self.config.max_database_scans or self.config.max_database_bytes:
+            if self.config.index != "exact":
+                raise ValueError("A bounded database is always searched exhaustively")
+            self.database = LifelongDatabase(
+                self.config.num_range,
+                self.config.num_angle,
+                max_scans=self.config.max_database_scans,
+                max_bytes=self.config.max_database_bytes,
+                policy=self.config.eviction_policy,
+                dtype=self.config.descriptor_dtype,
+            )
+        else:
+            self.database = SolidDatabase(
+                self.config.num_range,
+                self.config.num_angle,
+                index=make_index(self.config),
+                dtype=self.config.descriptor_dtype,
+            )
+        self.num_scans = 0
+        # Timestamps of the scans still inside the exclusion window, and how many left it
+        self._recent_timestamps = deque()
+        self._num_expired = 0
+        self.latencies = deque(maxlen=100000)
+
+    def __len__(self):
+        return self.num_scans
+
+    def _num_candidates(self, query_idx: int, timestamp: Optional[float]) -> int:
+        if self.config.exclusion_seconds is not None:
+            # Only the timestamps inside the exclusion window are kept, older scans are counted
+            horizon = timestamp - self.config.exclusion_seconds
+            while self._recent_timestamps and self._recent_timestamps[0] <= horizon:
+                self._recent_timestamps.popleft()
+                self._num_expired += 1
+            self._recent_timestamps.append(timestamp)
+        return int(
+            num_candidates(
+                query_idx,
+                self.config.exclusion_frames,
+                self.config.exclusion_seconds,
+                times=self._recent_timestamps,
+                first=self._num_expired,
+            )
+        )
+
+    def add_scan(self, points: np.ndarray, timestamp: Optional[float] = None) -> np.ndarray:
+        if self.config.exclusion_seconds is not None and timestamp is None:
+            raise ValueError("exclusion_seconds needs the timestamp of every scan")
+        start = time.perf_counter()
+        query_idx = self.num_scans
+
+        scan_downsampled = self.preprocess.filter_and_down_sampling(points)
+        r_solid_desc, a_solid_desc = self.solid.get_descriptor(scan_downsampled)
+        self.database.append(r_solid_desc, a_solid_desc)
+        self.num_scans += 1
+        query_row = self.database.rows(query_idx)
+
+        closures = np.empty((0, 4))
+        num_candidates = self._num_candidates(query_idx, timestamp)
+        if num_candidates > 0:
+            candidate_ids, cosdist = self.database.search(
+                self.database.rsolid[query_row], num_candidates, k=self.config.top_k
+            )
+            best_first = np.argsort(cosdist, kind="stable")
+            best_first = best_first[cosdist[best_first] < self.config.loop_threshold]
+            loop_candidates, loop_cosdist = candidate_ids[best_first], cosdist[best_first]
+            if len(loop_candidates):
+                angle_differences = self.solid.pose_estimation_batch(
+                    self.database.asolid[query_row],
+                    self.database.asolid[self.database.rows(loop_candidates)],
+                    mode=self.config.yaw_mode,
+                )
+                closures = np.column_stack(
+                    [
+                        loop_candidates,
+                        np.full(len(loop_candidates), query_idx),
+                        angle_differences,
+                        loop_cosdist,
+                    ]
+                )
+
+        self.latencies.append(time.perf_counter() - start)
+        return closures
+
+    def latency_stats(self) -> Dict[str, float]:
+        if not self.latencies:
+            return {}
+        latencies = np.asarray(self.latencies)
+        p50, p90, p95, p99 = np.percentile(latencies, [50, 90, 95, 99])
+        return {
+            "calls": self.num_scans,
+            "mean_s": float(latencies.mean()),
+            "p50_s": float(p50),
+            "p90_s": float(p90),
+            "p95_s": float(p95),
+            "p99_s": float(p99),
+            "max_s": float(latencies.max()),
+            "over_budget": int(np.count_nonzero(latencies > self.latency_budget)),
+        }
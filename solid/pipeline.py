@@ -21,17 +21,89 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 import datetime
+import multiprocessing
+from collections import deque
 import os
+import sys
+import time
 from pathlib import Path
-from typing import Optional
+from typing import Dict, Optional
 
 import numpy as np
+from rich.console import Console
 
 from solid.config import load_config
+from solid.core.database import LifelongDatabase, SolidDatabase
+from solid.core.exclusion import num_candidates
+from solid.core.index import make_index
+from solid.core.keyframes import KeyframeGate
 from solid.core.solid import SOLiDModule
 from solid.core.point_module import PointModule
-from solid.tools.pipeline_results import PipelineResults
+from solid.core.streaming_descriptor import StreamingDescriptor
+from solid.datasets import scan_times
+from solid.tools.descriptor_cache import DescriptorCache
+from solid.tools.distance_matrix import MATRIX_DTYPES, compute_distance_matrix
+from solid.tools.memory import MemoryTracker
+from solid.tools.pipeline_results import PipelineResults, RetrievalComparison
+from solid.tools.prefetch import PrefetchDataset
 from solid.tools.progress_bar import get_progress_bar
+from solid.tools.streaming import Stage, StreamingEngine
+from solid.tools.timing import StageTimings
+
+
+def compute_descriptor(scan, preprocess: PointModule, solid: SOLiDModule, timings: StageTimings):
+    start = timings.now()
+    scan = preprocess.range_filter(scan)
+    start = timings.record("range_filter", start)
+    scan_downsampled = preprocess.down_sampling(scan)
+    start = timings.record("down_sampling", start)
+    descriptor = solid.get_descriptor(scan_downsampled)
+    timings.record("descriptor", start)
+    return descriptor
+
+
+def load_descriptor(dataset, idx: int, preprocess, solid, builder, timings: StageTimings):
+    """Descriptor of scan idx, built from chunks of the scan file when a builder is given"""
+    start = timings.now()
+    if builder is None:
+        scan = dataset[idx]
+        timings.record("load", start)
+        return compute_descriptor(scan, preprocess, solid, timings)
+    chunks = dataset.scan_chunks(idx, builder.chunk_size)
+    start = timings.record("load", start)
+    descriptor = builder.build(chunks)
+    timings.record("descriptor", start)
+    return descriptor
+
+
+def make_builder(dataset, config):
+    """StreamingDescriptor for dataloaders that serve scans in chunks, if chunk_size is set"""
+    if config.chunk_size is None or not hasattr(dataset, "scan_chunks"):
+        return None
+    return StreamingDescriptor(PointModule(config), SOLiDModule(config), config.chunk_size)
+
+
+_worker_state = {}
+
+
+def _init_extraction_worker(dataset, config):
+    _worker_state["dataset"] = dataset
+    _worker_state["preprocess"] = PointModule(config)
+    _worker_state["solid"] = SOLiDModule(config)
+    _worker_state["builder"] = make_builder(dataset, config)
+
+
+def _extract_descriptor(idx: int):
+    timings = StageTimings()
+    r_solid_desc, a_solid_desc = load_descriptor(
+        _worker_state["dataset"],
+        idx,
+        _worker_state["preprocess"],
+        _worker_state["solid"],
+        _worker_state["builder"],
+        timings,
+    )
+    return r_solid_desc, a_solid_desc, timings
 
 
 class SolidPipeline:
@@ -40,30 +112,136 @@ class SolidPipeline:
         dataset,
         results_dir: Path,
         config: Optional[Path] = None,
+        workers: int = 1,
+        cache_dir: Optional[Path] = None,
+        stage_workers: Optional[Dict[str, int]] = None,
+        queue_size: int = 8,
+        evaluate_index: bool = False,
+        track_memory: int = 0,
+        evaluate_quantization: bool = False,
+        evaluate_keyframes: bool = False,
+        distance_matrix: Optional[str] = None,
+        matrix_memory: int = 256 * 2**20,
     ):
+        if workers > 1 and isinstance(dataset, PrefetchDataset):
+            raise ValueError(
+                "Prefetching reads ahead in this process, use streaming load workers, not workers"
+            )
         self._dataset = dataset
         self._first = 0
         self._last = len(self._dataset)
 
         self.results_dir = results_dir
+        self.workers = workers
+        self.stage_workers = stage_workers
+        self.queue_size = queue_size
+        self.streaming_engine = None
+        self.timings = StageTimings()
+        self.memory = MemoryTracker(track_memory) if track_memory > 0 else None
 
         self.config = load_config(config)
         self.solid = SOLiDModule(self.config)
         self.preprocess = PointModule(self.config)
-        self.rsolid_database = []
-        self.asolid_database = []
+        self.builder = make_builder(self._dataset, self.config)
+        self.lifelong = bool(self.config.max_database_scans or self.config.max_database_bytes)
+        if self.lifelong:
+            if self.config.index != "exact":
+                raise ValueError("A bounded database is always searched exhaustively")
+            self.database = LifelongDatabase(
+                self.config.num_range,
+                self.config.num_angle,
+                max_scans=self.config.max_database_scans,
+                max_bytes=self.config.max_database_bytes,
+                policy=self.config.eviction_policy,
+                dtype=self.config.descriptor_dtype,
+            )
+        else:
+            self.database = SolidDatabase(
+                self.config.num_range,
+                self.config.num_angle,
+                capacity=len(self._dataset),
+                index=make_index(self.config),
+                dtype=self.config.descriptor_dtype,
+            )
+        self.keyframes = KeyframeGate(
+            self.config.keyframe_distance,
+            self.config.keyframe_min_frames,
+            capacity=len(self._dataset),
+        )
+        if distance_matrix is not None and (self.keyframes.enabled or self.lifelong):
+            raise ValueError(
+                "The distance matrix needs every scan in the database, not keyframes or a budget"
+            )
+        if distance_matrix is not None and distance_matrix not in MATRIX_DTYPES:
+            raise ValueError(
+                f"Unsupported distance matrix dtype '{distance_matrix}', use one of {MATRIX_DTYPES}"
+            )
+        self.distance_matrix = distance_matrix
+        self.matrix_memory = matrix_memory
+        # Descriptors of the scans that were not inserted, until they are queried. A bounded
+        # database only inserts scans once they are queried
+        self._pending_queries = {}
+        self._num_described = 0
+        self._cached_descriptors = None
         self.dataset_name = self._dataset.sequence_id
+        self.descriptor_cache = (
+            DescriptorCache(cache_dir, self._dataset, self.config) if cache_dir else None
+        )
+
+        self.scan_times = None
+        if self.config.exclusion_seconds is not None:
+            self.scan_times = scan_times(self._dataset)
+            if self.scan_times is None:
+                raise ValueError(
+                    "exclusion_seconds needs a dataloader with timestamps, use exclusion_frames"
+                )
 
         self.closures = []
         self.gt_closure_indices = self._dataset.gt_closure_indices
 
         solid_thresholds = np.arange(self.config.loop_threshold, 0.04, 0.004)
+        self.solid_thresholds = solid_thresholds
         self.results = PipelineResults(
-            self.gt_closure_indices, self.dataset_name, solid_thresholds
+            self.gt_closure_indices, self.dataset_name, solid_thresholds, top_k=self.config.top_k
         )
+        self.results.timings = self.timings
+        self.index_comparison = (
+            RetrievalComparison(
+                f"{self.config.index} index vs exact search",
+                solid_thresholds,
+                top_k=self.config.top_k,
+            )
+            if evaluate_index
+            else None
+        )
+        # Float64 twin of the database holding every scan, to measure what quantized storage and
+        # keyframe selection cost in accuracy
+        self.reference_features = []
+        if evaluate_quantization and self.config.descriptor_dtype != "float64":
+            self.reference_features.append(f"{self.config.descriptor_dtype} descriptors")
+        if evaluate_keyframes and self.keyframes.enabled:
+            self.reference_features.append("keyframes")
+        self.reference_database, self.reference_results = None, None
+        if self.reference_features:
+            self.reference_database = SolidDatabase(
+                self.config.num_range,
+                self.config.num_angle,
+                capacity=len(self._dataset),
+                index=make_index(self.config),
+            )
+            self.reference_results = PipelineResults(
+                self.gt_closure_indices,
+                self.dataset_name,
+                solid_thresholds,
+                top_k=self.config.top_k,
+            )
 
     def run(self):
-        self._run_pipeline()
+        try:
+            self._run_pipeline()
+        finally:
+            if self.descriptor_cache is not None:
+                self.descriptor_cache.close()
         if self.gt_closure_indices is not None:
             self._run_evaluation()
         self._log_to_file()
@@ -71,32 +249,262 @@ class SolidPipeline:
         return self.results
 
     def _run_pipeline(self):
-        for query_idx in get_progress_bar(self._first, self._last):
+        if self.descriptor_cache is not None:
+            r_solids, a_solids = self.descriptor_cache.load()
+            if self.lifelong:
+                # Read back from the cache files when queried, instead of held in memory
+                self._cached_descriptors = (r_solids, a_solids)
+                self._num_described = len(r_solids)
+            elif self.keyframes.enabled:
+                for r_solid_desc, a_solid_desc in zip(r_solids, a_solids):
+                    self._insert_descriptor(r_solid_desc, a_solid_desc)
+            else:
+                self.database.extend(r_solids, a_solids)
+                self._num_described = len(r_solids)
+            if self.reference_database is not None:
+                self.reference_database.extend(r_solids, a_solids)
+
+        if self.stage_workers is not None:
+            self._run_streaming()
+        elif self.workers > 1:
+            self._extract_descriptors_parallel()
+            if not self.lifelong:
+                for query_idx in get_progress_bar(self._first, self._last):
+                    self._detect_loops(query_idx)
+        else:
+            for query_idx in get_progress_bar(self._first, self._last):
+                if query_idx >= self._num_described:
+                    self._store_descriptor(
+                        *load_descriptor(
+                            self._dataset,
+                            query_idx,
+                            self.preprocess,
+                            self.solid,
+                            self.builder,
+                            self.timings,
+                        )
+                    )
+                self._detect_loops(query_idx)
+
+        if self.memory is not None:
+            self.memory.sample(self._last - self._first, self._memory_structures())
+
+    def _memory_structures(self) -> Dict[str, int]:
+        closures = sys.getsizeof(self.closures)
+        if self.closures:
+            closures += len(self.closures) * sys.getsizeof(self.closures[0])
+        return {
+            "pending_queries": sum(
+                r_solid.nbytes + a_solid.nbytes
+                for r_solid, a_solid in self._pending_queries.values()
+            ),
+            "rsolid_database": self.database.rsolid.nbytes,
+            "asolid_database": self.database.asolid.nbytes,
+            "closures": closures,
+            "predicted_closures": self.results.distance_log.nbytes,
+        }
+
+    def _insert_descriptor(self, r_solid_desc, a_solid_desc):
+        scan_idx = self._num_described
+        self._num_described += 1
+        if self.lifelong:
+            self._pending_queries[scan_idx] = (r_solid_desc, a_solid_desc)
+        elif not self.keyframes.enabled:
+            self.database.append(r_solid_desc, a_solid_desc)
+        elif self.keyframes.admit(scan_idx, r_solid_desc):
+            self.database.append(r_solid_desc, a_solid_desc)
+        else:
+            self._pending_queries[scan_idx] = (r_solid_desc, a_solid_desc)
+
+    def _store_descriptor(self, r_solid_desc, a_solid_desc):
+        self._insert_descriptor(r_solid_desc, a_solid_desc)
+        if self.reference_database is not None:
+            self.reference_database.append(r_solid_desc, a_solid_desc)
+        if self.descriptor_cache is not None:
+            self.descriptor_cache.append(r_solid_desc, a_solid_desc)
+
+    def _extract_descriptors_parallel(self):
+        first = self._num_described
+        if self.lifelong:
+            # A bounded database is filled at query time, so scans are queried as soon as their
+            # descriptor arrives rather than after the whole sequence was extracted
+            for query_idx in range(self._first, first):
+                self._detect_loops(query_idx)
+        if first >= self._last:
+            return
+        # Forked workers inherit the dataset, so dataloaders need not be picklable
+        methods = multiprocessing.get_all_start_methods()
+        context = multiprocessing.get_context("fork" if "fork" in methods else None)
+        with context.Pool(
+            self.workers, _init_extraction_worker, (self._dataset, self.config)
+        ) as pool:
+            # At most queue_size descriptors per worker are extracted ahead of the consumer
+            lookahead = self.workers * self.queue_size
+            in_flight = deque()
+            for scan_idx in get_progress_bar(first, self._last):
+                while len(in_flight) < lookahead and scan_idx + len(in_flight) < self._last:
+                    next_idx = scan_idx + len(in_flight)
+                    in_flight.append(pool.apply_async(_extract_descriptor, (next_idx,)))
+                r_solid_desc, a_solid_desc, timings = in_flight.popleft().get()
+                self._store_descriptor(r_solid_desc, a_solid_desc)
+                self.timings.merge(timings)
+                if self.lifelong:
+                    self._detect_loops(scan_idx)
+
+    def _run_streaming(self):
+        num_cached = self._num_described
+
+        timings = self.timings
+
+        def load(query_idx):
+            if query_idx < num_cached:
+                return query_idx, None
+            start = timings.now()
             scan = self._dataset[query_idx]
-            scan = self.preprocess.remove_closest_points(scan)
-            scan = self.preprocess.remove_far_points(scan)
-            scan_downsampled = self.preprocess.down_sampling(scan)
-            r_solid_desc, a_solid_desc = self.solid.get_descriptor(scan_downsampled)
-            self.rsolid_database.append(r_solid_desc)
-            self.asolid_database.append(a_solid_desc)
-            
-            if query_idx > 100:
-                cosdist = []
-                for candidate_idx in range(query_idx - 100):
-                    query_R_solid     = self.rsolid_database[query_idx]
-                    candidate_R_solid = self.rsolid_database[candidate_idx]
-                    cosine_similarity = self.solid.loop_detection(query_R_solid, candidate_R_solid)
-                    cosdist = 1-cosine_similarity
-                    if cosdist < self.config.loop_threshold:
-                        query_A_solid     = self.asolid_database[query_idx]
-                        candidate_A_solid = self.asolid_database[candidate_idx]
-                        angle_difference  = self.solid.pose_estimation(query_A_solid, candidate_A_solid)
-                        self.closures.append(np.r_[candidate_idx, query_idx, angle_difference])
-                    self.results.append(query_idx, candidate_idx, cosdist)
+            timings.record("load", start)
+            return query_idx, scan
+
+        def preprocess(item):
+            query_idx, scan = item
+            if scan is not None:
+                start = timings.now()
+                scan = self.preprocess.range_filter(scan)
+                start = timings.record("range_filter", start)
+                scan = self.preprocess.down_sampling(scan)
+                timings.record("down_sampling", start)
+            return query_idx, scan
+
+        def describe(item):
+            query_idx, scan = item
+            if scan is None:
+                return query_idx, None
+            start = timings.now()
+            descriptor = self.solid.get_descriptor(scan)
+            timings.record("descriptor", start)
+            return query_idx, descriptor
+
+        def retrieve(item):
+            query_idx, descriptor = item
+            if descriptor is not None:
+                self._store_descriptor(*descriptor)
+            return self._retrieve(query_idx)
+
+        progress_bar = get_progress_bar(self._first, self._last)
+
+        def sink(retrieved):
+            self._record(*retrieved)
+            progress_bar.update(1)
+
+        workers = self.stage_workers
+        self.streaming_engine = StreamingEngine(
+            [
+                Stage("load", load, workers.get("load", 1)),
+                Stage("preprocess", preprocess, workers.get("preprocess", 1)),
+                Stage("describe", describe, workers.get("describe", 1)),
+                Stage("retrieve", retrieve, ordered=True),
+                Stage("sink", sink, ordered=True),
+            ],
+            queue_size=self.queue_size,
+        )
+        self.streaming_engine.run(range(self._first, self._last))
+        progress_bar.close()
+
+    def _detect_loops(self, query_idx: int):
+        self._record(*self._retrieve(query_idx))
+
+    def _query_descriptors(self, query_idx: int):
+        if self.lifelong:
+            # Inserted only when queried, so that scans are evicted in the same order whether
+            # descriptors were extracted in parallel, cached or computed one by one
+            if query_idx not in self._pending_queries:
+                r_solids, a_solids = self._cached_descriptors
+                r_solid_desc = np.array(r_solids[query_idx])
+                a_solid_desc = np.array(a_solids[query_idx])
+            else:
+                r_solid_desc, a_solid_desc = self._pending_queries.pop(query_idx)
+            if not self.keyframes.enabled or self.keyframes.admit(query_idx, r_solid_desc):
+                self.database.append(r_solid_desc, a_solid_desc)
+            return r_solid_desc, a_solid_desc
+        if query_idx in self._pending_queries:
+            return self._pending_queries.pop(query_idx)
+        row = self.keyframes.num_candidates(query_idx) if self.keyframes.enabled else query_idx
+        return self.database.rsolid[row], self.database.asolid[row]
+
+    def _retrieve(self, query_idx: int):
+        query_R_solid, query_A_solid = self._query_descriptors(query_idx)
+        max_scan_idx = int(
+            num_candidates(
+                query_idx,
+                self.config.exclusion_frames,
+                self.config.exclusion_seconds,
+                times=self.scan_times,
+            )
+        )
+        if max_scan_idx <= 0:
+            return query_idx, None, None, []
+        if self.reference_database is not None:
+            reference_ids, reference_cosdist = self.reference_database.search(
+                self.reference_database.rsolid[query_idx], max_scan_idx, k=self.config.top_k
+            )
+            self.reference_results.append(query_idx, reference_ids, reference_cosdist)
 
+        num_rows = max_scan_idx
+        if self.keyframes.enabled:
+            num_rows = self.keyframes.num_candidates(max_scan_idx)
+            if num_rows == 0:
+                return query_idx, None, None, []
+
+        start = self.timings.now()
+        candidate_rows, cosdist = self.database.search(
+            query_R_solid, num_rows, k=self.config.top_k
+        )
+        stop = self.timings.record("retrieval", start)
+        if self.index_comparison is not None:
+            search_time = (stop - start) * 1e-9
+            start = time.perf_counter()
+            exact_cosdist = self.database.cosine_distances(query_R_solid, num_rows)
+            self.index_comparison.append(
+                exact_cosdist, candidate_rows, time.perf_counter() - start, search_time
+            )
+        candidate_ids = candidate_rows
+        if self.keyframes.enabled:
+            candidate_ids = self.keyframes.keyframe_ids[candidate_rows]
+
+        loop_candidates = np.flatnonzero(cosdist < self.config.loop_threshold)
+        max_candidates = self.config.max_yaw_candidates
+        if max_candidates is not None and len(loop_candidates) > max_candidates:
+            best = np.argpartition(cosdist[loop_candidates], max_candidates - 1)
+            loop_candidates = np.sort(loop_candidates[best[:max_candidates]])
+        closures = []
+        if len(loop_candidates):
+            start = self.timings.now()
+            candidate_A_solids = self.database.asolid[
+                self.database.rows(candidate_rows[loop_candidates])
+            ]
+            angle_differences  = self.solid.pose_estimation_batch(
+                query_A_solid, candidate_A_solids, mode=self.config.yaw_mode
+            )
+            for candidate_idx, angle_difference in zip(
+                candidate_ids[loop_candidates], angle_differences
+            ):
+                closures.append(np.r_[candidate_idx, query_idx, angle_difference])
+            self.timings.record("yaw_estimation", start)
+        return query_idx, candidate_ids, cosdist, closures
+
+    def _record(self, query_idx: int, candidate_ids, cosdist, closures):
+        start = self.timings.now()
+        self.closures.extend(closures)
+        if cosdist is not None:
+            self.results.append(query_idx, candidate_ids, cosdist)
+        self.timings.record("results_append", start)
+        num_scans = query_idx + 1 - self._first
+        if self.memory is not None and self.memory.due(num_scans):
+            self.memory.sample(num_scans, self._memory_structures())
 
     def _run_evaluation(self) -> None:
         self.results.compute_metrics()
+        if self.reference_results is not None:
+            self.reference_results.compute_metrics()
 
     def _log_to_file(self) -> None:
         self.results_dir = self._create_results_dir()
@@ -104,6 +512,64 @@ class SolidPipeline:
             self.results.log_to_file_pr(os.path.join(self.results_dir, "metrics.txt"))
         self.results.log_to_file_closures(self.results_dir)
         np.savetxt(os.path.join(self.results_dir, "closures.txt"), np.asarray(self.closures))
+        self.timings.log_to_file(os.path.join(self.results_dir, "timings.json"))
+        if self.keyframes.enabled:
+            self._log_keyframes()
+        if self.streaming_engine is not None:
+            self.streaming_engine.log_to_file(os.path.join(self.results_dir, "streaming.json"))
+            self.streaming_engine.log_to_console(f"{self.dataset_name} streaming stages")
+        if self.memory is not None:
+            self.memory.log_to_file(os.path.join(self.results_dir, "memory.json"))
+            self.memory.log_to_console(f"{self.dataset_name} memory")
+        if self.index_comparison is not None:
+            self.index_comparison.log_to_file(os.path.join(self.results_dir, "index.json"))
+            self.index_comparison.log_to_console()
+        if self.reference_results is not None and self.results.metrics:
+            title = f"{' + '.join(self.reference_features)} vs float64 descriptors of every scan"
+            caption = (
+                f"Database: {len(self.database)} scans, {self.database.nbytes / 2**20:.2f} MiB vs "
+                f"{len(self.reference_database)} scans, "
+                f"{self.reference_database.nbytes / 2**20:.2f} MiB"
+            )
+            self.results.log_delta_to_file(
+                self.reference_results, os.path.join(self.results_dir, "reference_deltas.json")
+            )
+            self.results.log_delta_to_console(self.reference_results, title, caption)
+        if self.distance_matrix is not None:
+            self._log_distance_matrix()
+
+    def _log_distance_matrix(self) -> None:
+        filename = os.path.join(self.results_dir, "distance_matrix.bin")
+        distance_matrix = compute_distance_matrix(
+            np.asarray(self.database.rsolid), filename, self.distance_matrix, self.matrix_memory
+        )
+        if self.gt_closure_indices is None:
+            return
+        matrix_results = PipelineResults(
+            self.gt_closure_indices,
+            f"{self.dataset_name} (distance matrix, exhaustive)",
+            self.solid_thresholds,
+        )
+        matrix_results.compute_metrics_from_matrix(
+            distance_matrix,
+            self.config.exclusion_frames,
+            self.matrix_memory,
+            times=self.scan_times,
+            exclusion_seconds=self.config.exclusion_seconds,
+        )
+        matrix_results.log_to_file_pr(os.path.join(self.results_dir, "metrics_matrix.txt"))
+        matrix_results.log_to_console()
+
+    def _log_keyframes(self) -> None:
+        # A bounded database may have evicted keyframes since, so count the accepted ones
+        num_scans, num_keyframes = self._num_described, len(self.keyframes)
+        np.savetxt(
+            os.path.join(self.results_dir, "keyframes.txt"), self.keyframes.keyframe_ids, fmt="%d"
+        )
+        Console().print(
+            f"Keyframes: {num_keyframes} of {num_scans} scans accepted "
+            f"({1 - num_keyframes / max(num_scans, 1):.1%} fewer)"
+        )
 
     def _create_results_dir(self) -> Path:
         def get_timestamp() -> str:
@@ -0,0 +1,233 @@
+# MIT License
+#
+# Copyright (c) 2023 Saurabh Gupta, Tiziano Guadagnino, Cyrill Stachniss.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+import csv
+import importlib
+import json
+import multiprocessing
+import os
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import typer
+from rich import box
+from rich.console import Console
+from rich.table import Table
+
+from solid.tools.pipeline_results import add_best_f1_columns, best_f1_cells, metrics_to_dict
+
+JOB_FIELDS = ("dataloader", "data", "sequence", "config")
+
+
+def load_manifest(manifest_file: Path) -> List[Dict]:
+    """Jobs of a JSON or YAML manifest: a list of jobs, or {"defaults": {...}, "jobs": [...]}.
+
+    Every job needs a dataloader and a data directory; sequence, config and name are optional and
+    fall back to the defaults."""
+    with open(manifest_file) as manifest:
+        if str(manifest_file).endswith(".json"):
+            content = json.load(manifest)
+        else:
+            content = importlib.import_module("yaml").safe_load(manifest)
+    if isinstance(content, list):
+        content = {"jobs": content}
+
+    jobs, names = [], set()
+    for entry in content["jobs"]:
+        job = {field: None for field in JOB_FIELDS}
+        job.update(content.get("defaults", {}))
+        job.update(entry)
+        if job["dataloader"] is None or job["data"] is None:
+            raise ValueError(f"Job {entry} needs at least a dataloader and a data directory")
+        if not job.get("name"):
+            sequence = job["sequence"] or Path(job["data"]).name
+            config = Path(job["config"]).stem if job["config"] else "default"
+            job["name"] = f"{job['dataloader']}_{sequence}_{config}"
+        if job["name"] in names:
+            raise ValueError(f"Duplicated job name '{job['name']}'")
+        names.add(job["name"])
+        jobs.append(job)
+    return jobs
+
+
+def _status_file(output_dir: Path, job: Dict) -> str:
+    return os.path.join(output_dir, job["name"], "status.json")
+
+
+def read_status(output_dir: Path, job: Dict) -> Optional[Dict]:
+    try:
+        with open(_status_file(output_dir, job)) as status_file:
+            return json.load(status_file)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+
+def _write_status(output_dir: Path, job: Dict, status: Dict) -> None:
+    filename = _status_file(output_dir, job)
+    os.makedirs(os.path.dirname(filename), exist_ok=True)
+    with open(filename + ".tmp", "w") as status_file:
+        json.dump(status, status_file, indent=2)
+    os.replace(filename + ".tmp", filename)
+
+
+def run_job(job: Dict, output_dir: Path, cache_dir: Optional[Path]) -> Dict:
+    """Runs one manifest job and records its outcome in <output_dir>/<name>/status.json"""
+    # Lazy-loading, workers only pay for the dataloaders they use
+    from solid.datasets import dataset_factory
+    from solid.pipeline import SolidPipeline
+
+    start = time.perf_counter()
+    status = {"job": job, "status": "failed", "metrics": {}}
+    try:
+        dataset = dataset_factory(
+            dataloader=job["dataloader"],
+            data_dir=Path(job["data"]),
+            sequence=job["sequence"],
+            prefetch=job.get("prefetch", 0),
+        )
+        results = SolidPipeline(
+            dataset=dataset,
+            results_dir=os.path.join(output_dir, job["name"]),
+            config=job["config"],
+            workers=job.get("workers", 1),
+            cache_dir=cache_dir,
+        ).run()
+        status["status"] = "done"
+        status["sequence_id"] = dataset.sequence_id
+        status["metrics"] = metrics_to_dict(results.metrics)
+    except Exception:
+        status["error"] = traceback.format_exc()
+    status["time_s"] = time.perf_counter() - start
+    _write_status(output_dir, job, status)
+    return status
+
+
+def write_summary(statuses: List[Dict], filename: str) -> None:
+    """One CSV row per job and threshold"""
+    with open(filename, "w", newline="") as summary_file:
+        writer = csv.writer(summary_file)
+        writer.writerow(
+            ["job", *JOB_FIELDS, "status", "threshold"]
+            + ["tp", "fp", "fn", "precision", "recall", "f1"]
+        )
+        for status in statuses:
+            job = status["job"]
+            prefix = [job["name"], *(job[field] for field in JOB_FIELDS), status["status"]]
+            if not status["metrics"]:
+                writer.writerow(prefix)
+            for threshold, metric in status["metrics"].items():
+                writer.writerow(
+                    prefix
+                    + [threshold]
+                    + [metric[key] for key in ("tp", "fp", "fn", "precision", "recall", "f1")]
+                )
+
+
+def _rich_table_summary(statuses: List[Dict], table_format: box.Box = box.HORIZONTALS) -> Table:
+    table = Table(box=table_format, title="Batch summary")
+    table.caption = "Metrics at the threshold with the best F1 score of every job"
+    table.add_column("Job", justify="center", style="cyan")
+    table.add_column("Status", justify="center", style="magenta")
+    table.add_column("Time (s)", justify="center", style="magenta")
+    add_best_f1_columns(table)
+    for status in statuses:
+        row = [status["job"]["name"], status["status"], f"{status.get('time_s', 0.0):.1f}"]
+        table.add_row(
+            *row,
+            *best_f1_cells(status["metrics"]),
+            style=None if status["status"] == "done" else "red",
+        )
+    return table
+
+
+def run_batch(
+    jobs: List[Dict],
+    output_dir: Path,
+    concurrency: int = 1,
+    cache_dir: Optional[Path] = None,
+    rerun: bool = False,
+) -> List[Dict]:
+    """Runs the jobs that did not finish in a previous run of the same output directory across
+    `concurrency` processes, then writes summary.csv there"""
+    statuses = {job["name"]: read_status(output_dir, job) for job in jobs}
+    pending = [
+        job
+        for job in jobs
+        if rerun or statuses[job["name"]] is None or statuses[job["name"]]["status"] != "done"
+    ]
+    console = Console()
+    console.print(f"{len(jobs) - len(pending)} of {len(jobs)} jobs already done")
+
+    methods = multiprocessing.get_all_start_methods()
+    context = multiprocessing.get_context("fork" if "fork" in methods else None)
+    with ProcessPoolExecutor(max(concurrency, 1), mp_context=context) as executor:
+        futures = {executor.submit(run_job, job, output_dir, cache_dir): job for job in pending}
+        for future in as_completed(futures):
+            job = futures[future]
+            try:
+                statuses[job["name"]] = future.result()
+            except Exception:
+                # The worker itself died, e.g. killed by the OOM killer
+                statuses[job["name"]] = {"job": job, "status": "failed", "metrics": {}}
+                statuses[job["name"]]["error"] = traceback.format_exc()
+                _write_status(output_dir, job, statuses[job["name"]])
+            console.print(f"{job['name']}: {statuses[job['name']]['status']}")
+
+    statuses = [statuses[job["name"]] for job in jobs]
+    write_summary(statuses, os.path.join(output_dir, "summary.csv"))
+    console.print(_rich_table_summary(statuses))
+    return statuses
+
+
+app = typer.Typer(add_completion=False, rich_markup_mode="rich")
+
+
+@app.command(help="Run a manifest of (dataloader, data, sequence, config) jobs")
+def solid_batch(
+    manifest: Path = typer.Argument(
+        ..., exists=True, help="JSON or YAML manifest of the jobs", show_default=False
+    ),
+    output_dir: Path = typer.Argument(
+        ..., help="Where the results of every job and summary.csv are stored", show_default=False
+    ),
+    concurrency: int = typer.Option(
+        1, "--concurrency", "-j", min=1, help="[Optional] Jobs running at the same time"
+    ),
+    cache_dir: Optional[Path] = typer.Option(
+        None,
+        "--cache-dir",
+        show_default=False,
+        help="[Optional] Descriptor cache shared by all the jobs",
+    ),
+    rerun: bool = typer.Option(
+        False, "--rerun", help="[Optional] Also run again the jobs that already finished"
+    ),
+):
+    statuses = run_batch(load_manifest(manifest), output_dir, concurrency, cache_dir, rerun)
+    if any(status["status"] != "done" for status in statuses):
+        raise typer.Exit(1)
+
+
+def run():
+    app()
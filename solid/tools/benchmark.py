@@ -0,0 +1,288 @@
+# MIT License
+#
+# Copyright (c) 2023 Saurabh Gupta, Ignacio Vizzo, Tiziano Guadagnino, Benedikt Mersch,
+# Cyrill Stachniss.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+import json
+import os
+import platform
+import tempfile
+import time
+from importlib import resources
+from pathlib import Path
+from typing import Callable, Dict, List
+
+import numpy as np
+import typer
+from rich import box
+from rich.console import Console
+from rich.table import Table
+
+from solid.config import SolidConfig, load_config
+
+# Scan pattern of each sensor, the descriptor parameters are read from its config
+SENSORS = {
+    "Aeva": dict(channels=64, columns=1200, horizontal_fov=120.0, vertical_fov=(-9.6, 9.6)),
+    "Avia": dict(channels=96, columns=250, horizontal_fov=70.4, vertical_fov=(-38.6, 38.6)),
+    "Ouster": dict(channels=64, columns=1024, horizontal_fov=360.0, vertical_fov=(-22.5, 22.5)),
+}
+
+
+def sensor_config_file(sensor: str):
+    """The config_<sensor>.yaml installed with the solid.config package"""
+    return resources.files("solid.config") / f"config_{sensor}.yaml"
+
+
+class SyntheticDataset:
+    """Deterministic LiDAR-like scans along a trajectory that drives the same loop twice.
+
+    Every beam returns the closer of the ground plane and a wall whose distance varies smoothly
+    with the bearing and the position on the loop, so revisited places produce similar scans."""
+
+    def __init__(self, sensor: str, num_scans: int = 400, seed: int = 0, loop_length: int = 200):
+        self.sensor = SENSORS[sensor]
+        self.sequence_id = f"synthetic_{sensor}"
+        self.num_scans = num_scans
+        self.seed = seed
+        self.loop_length = loop_length
+        self.gt_closure_indices = None
+
+        azimuth = np.deg2rad(
+            np.linspace(-0.5, 0.5, self.sensor["columns"], endpoint=False)
+            * self.sensor["horizontal_fov"]
+        )
+        elevation = np.deg2rad(np.linspace(*self.sensor["vertical_fov"], self.sensor["channels"]))
+        self._azimuth, self._elevation = np.meshgrid(azimuth, elevation)
+
+    def __len__(self):
+        return self.num_scans
+
+    def __getitem__(self, idx):
+        place = 2 * np.pi * (idx % self.loop_length) / self.loop_length
+        rng = np.random.default_rng(self.seed + idx)
+        heading = self._azimuth + place
+        wall = 15.0 + 8.0 * np.sin(3 * heading + 5 * np.sin(place)) + 4.0 * np.cos(7 * heading)
+        sensor_height = 1.8
+        with np.errstate(divide="ignore"):
+            ground = np.where(self._elevation < 0, sensor_height / np.tan(-self._elevation), np.inf)
+        ranges = np.minimum(wall / np.cos(self._elevation), ground / np.cos(self._elevation))
+        ranges = ranges + rng.normal(scale=0.02, size=ranges.shape)
+        points = np.stack(
+            [
+                ranges * np.cos(self._elevation) * np.cos(self._azimuth),
+                ranges * np.cos(self._elevation) * np.sin(self._azimuth),
+                ranges * np.sin(self._elevation),
+            ],
+            axis=-1,
+        ).reshape(-1, 3)
+        return points[np.isfinite(points).all(axis=1)]
+
+
+def _timings(fn: Callable, repeats: int) -> Dict[str, float]:
+    durations = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        durations.append(time.perf_counter() - start)
+    durations = np.asarray(durations)
+    return {
+        "median_s": float(np.median(durations)),
+        "min_s": float(durations.min()),
+        "mean_s": float(durations.mean()),
+        "repeats": repeats,
+    }
+
+
+def benchmark_stages(sensor: str, repeats: int) -> Dict[str, Dict[str, float]]:
+    from solid.core.point_module import PointModule
+    from solid.core.solid import SOLiDModule
+
+    with resources.as_file(sensor_config_file(sensor)) as config_file:
+        config = load_config(config_file)
+    dataset = SyntheticDataset(sensor)
+    preprocess, solid = PointModule(config), SOLiDModule(config)
+    scan = dataset[0]
+    filtered = preprocess.range_filter(scan)
+    downsampled = preprocess.down_sampling(filtered)
+
+    results = {
+        "range_filter": _timings(lambda: preprocess.range_filter(scan), repeats),
+        "down_sampling": _timings(lambda: preprocess.down_sampling(filtered), repeats),
+        "filter_and_down_sampling": _timings(
+            lambda: preprocess.filter_and_down_sampling(scan), repeats
+        ),
+        "ptcloud2solid": _timings(lambda: solid.ptcloud2solid(downsampled), repeats),
+    }
+    results["ptcloud2solid"]["points"] = len(downsampled)
+    results["range_filter"]["points"] = len(scan)
+    return results
+
+
+def benchmark_loader(sensor: str, repeats: int, num_scans: int = 20) -> Dict[str, float]:
+    from solid.datasets.mulran import MulranDataset
+
+    dataset = SyntheticDataset(sensor, num_scans=num_scans)
+    with tempfile.TemporaryDirectory() as data_dir:
+        os.makedirs(os.path.join(data_dir, "Ouster"))
+        for idx in range(num_scans):
+            scan = np.hstack([dataset[idx], np.zeros((len(dataset[idx]), 1))]).astype(np.float32)
+            scan.tofile(os.path.join(data_dir, "Ouster", f"{idx:06d}.bin"))
+        loader = MulranDataset(data_dir)
+        result = _timings(lambda: [loader[idx] for idx in range(num_scans)], repeats)
+    result["per_scan_s"] = result["median_s"] / num_scans
+    return result
+
+
+def benchmark_retrieval(sizes: List[int], queries: int = 200, seed: int = 0) -> Dict[str, Dict]:
+    from solid.core.database import SolidDatabase
+    from solid.core.index import IVFIndex
+
+    config = SolidConfig()
+    rng = np.random.default_rng(seed)
+    results = {}
+    for size in sizes:
+        places = rng.random((max(size // 20, 1), config.num_range))
+        descriptors = places[rng.integers(0, len(places), size)]
+        descriptors = descriptors + rng.normal(scale=0.01, size=descriptors.shape)
+        a_solids = np.zeros((size, config.num_angle))
+        query_ids = rng.integers(0, size, queries)
+        for name, index in (("exact", None), ("ivf", IVFIndex(train_size=min(size, 5000)))):
+            database = SolidDatabase(config.num_range, config.num_angle, size, index=index)
+            database.extend(descriptors, a_solids)
+            timing = _timings(
+                lambda: [database.search(descriptors[q], size, k=10) for q in query_ids], 1
+            )
+            results[f"{name}/{size}"] = {"per_query_s": timing["median_s"] / queries}
+    return results
+
+
+def benchmark_end_to_end(sensor: str, num_scans: int) -> Dict[str, float]:
+    from solid.pipeline import SolidPipeline
+
+    dataset = SyntheticDataset(sensor, num_scans=num_scans)
+    with tempfile.TemporaryDirectory() as results_dir:
+        with resources.as_file(sensor_config_file(sensor)) as config_file:
+            pipeline = SolidPipeline(dataset, results_dir, config=config_file)
+        start = time.perf_counter()
+        pipeline.run()
+        elapsed = time.perf_counter() - start
+    return {"total_s": elapsed, "scans_per_s": num_scans / elapsed, "scans": num_scans}
+
+
+app = typer.Typer(add_completion=False, rich_markup_mode="rich")
+
+
+@app.command("run", help="Run the benchmark suite on synthetic scans and store it as JSON")
+def run_benchmarks(
+    output: Path = typer.Argument(..., help="Where to write the results JSON", show_default=False),
+    sensors: List[str] = typer.Option(list(SENSORS), "--sensor", help="Sensor profiles to run"),
+    repeats: int = typer.Option(
+        10, "--repeats", min=1, help="Repetitions of every micro benchmark"
+    ),
+    num_scans: int = typer.Option(400, "--num-scans", min=1, help="Scans of the end-to-end run"),
+    database_sizes: List[int] = typer.Option(
+        [1000, 10000, 100000], "--database-size", help="Database sizes of the retrieval benchmark"
+    ),
+):
+    results = {}
+    for sensor in sensors:
+        if sensor not in SENSORS:
+            raise typer.BadParameter(f"Supported sensors are: {', '.join(SENSORS)}")
+        for stage, timing in benchmark_stages(sensor, repeats).items():
+            results[f"{sensor}/{stage}"] = timing
+        results[f"{sensor}/loader"] = benchmark_loader(sensor, repeats)
+        results[f"{sensor}/end_to_end"] = benchmark_end_to_end(sensor, num_scans)
+    for name, timing in benchmark_retrieval(database_sizes).items():
+        results[f"retrieval/{name}"] = timing
+
+    report = {
+        "meta": {
+            "date": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "machine": platform.machine(),
+            "processor": platform.processor(),
+        },
+        "results": results,
+    }
+    with open(output, "w") as output_file:
+        json.dump(report, output_file, indent=2)
+    _print_table(results)
+
+
+# The metric compared for every benchmark, and whether larger values are better
+def _headline_metric(result: Dict[str, float]):
+    if "scans_per_s" in result:
+        return "scans_per_s", True
+    if "per_query_s" in result:
+        return "per_query_s", False
+    return "median_s", False
+
+
+def _print_table(results: Dict[str, Dict[str, float]]) -> None:
+    table = Table(box=box.HORIZONTALS, title="SOLiD benchmark")
+    table.add_column("Benchmark", justify="left", style="cyan")
+    table.add_column("Metric", justify="center", style="magenta")
+    table.add_column("Value", justify="right", style="green")
+    for name, result in results.items():
+        metric, _ = _headline_metric(result)
+        table.add_row(name, metric, f"{result[metric]:.6g}")
+    Console().print(table)
+
+
+@app.command("compare", help="Compare two benchmark results and flag regressions")
+def compare(
+    baseline: Path = typer.Argument(..., exists=True, show_default=False),
+    candidate: Path = typer.Argument(..., exists=True, show_default=False),
+    tolerance: float = typer.Option(
+        0.1, "--tolerance", help="Relative slowdown tolerated before flagging a regression"
+    ),
+):
+    with open(baseline) as baseline_file, open(candidate) as candidate_file:
+        old, new = json.load(baseline_file)["results"], json.load(candidate_file)["results"]
+
+    table = Table(box=box.HORIZONTALS, title=f"{baseline.name} -> {candidate.name}")
+    table.add_column("Benchmark", justify="left", style="cyan")
+    table.add_column("Metric", justify="center", style="magenta")
+    table.add_column("Baseline", justify="right")
+    table.add_column("Candidate", justify="right")
+    table.add_column("Change", justify="right")
+    regressions = []
+    for name in sorted(set(old) & set(new)):
+        metric, higher_is_better = _headline_metric(new[name])
+        before, after = old[name][metric], new[name][metric]
+        # Positive change means slower, whatever the direction of the metric
+        change = (before / after - 1) if higher_is_better else (after / before - 1)
+        regressed = change > tolerance
+        if regressed:
+            regressions.append(name)
+        style = "red" if regressed else ("green" if change < -tolerance else "default")
+        table.add_row(
+            name, metric, f"{before:.6g}", f"{after:.6g}", f"[{style}]{change:+.1%}[/{style}]"
+        )
+    console = Console()
+    console.print(table)
+    if regressions:
+        console.print(f"[red]{len(regressions)} regression(s): {', '.join(regressions)}")
+        raise typer.Exit(code=1)
+
+
+def run():
+    app()
@@ -37,6 +37,29 @@ def name_callback(value: str):
     return value
 
 
+def stage_workers_callback(value: Optional[str]):
+    if not value:
+        return None
+    stage_workers = {}
+    for entry in value.split(","):
+        name, _, count = entry.partition("=")
+        if name.strip() not in ("load", "preprocess", "describe") or not count.strip().isdigit():
+            raise typer.BadParameter("Use e.g. 'load=4,preprocess=2,describe=2'")
+        stage_workers[name.strip()] = int(count)
+    return stage_workers
+
+
+def matrix_dtype_callback(value: Optional[str]):
+    if value is None:
+        return value
+    # Lazy-loading for faster CLI
+    from solid.tools.distance_matrix import MATRIX_DTYPES
+
+    if value not in MATRIX_DTYPES:
+        raise typer.BadParameter(f"Supported dtypes are: {', '.join(MATRIX_DTYPES)}")
+    return value
+
+
 app = typer.Typer(add_completion=False, rich_markup_mode="rich")
 
 # Remove from the help those dataloaders we explicitly say how to use
@@ -88,21 +111,124 @@ def solid_pipeline(
         help="[Optional] For some dataloaders, you need to specify a given sequence",
         rich_help_panel="Additional Options",
     ),
+    workers: int = typer.Option(
+        1,
+        "--workers",
+        "-j",
+        min=1,
+        help="[Optional] Extract descriptors in a pool of N processes before running retrieval",
+        rich_help_panel="Additional Options",
+    ),
+    cache_dir: Optional[Path] = typer.Option(
+        None,
+        "--cache-dir",
+        show_default=False,
+        help="[Optional] Reuse and extend the descriptors cached in this directory",
+        rich_help_panel="Additional Options",
+    ),
+    prefetch: int = typer.Option(
+        0,
+        "--prefetch",
+        min=0,
+        help="[Optional] Read the next N scans on background threads, not with --workers",
+        rich_help_panel="Additional Options",
+    ),
+    streaming: bool = typer.Option(
+        False,
+        "--streaming",
+        help="[Optional] Run the pipeline as concurrent stages connected by bounded queues",
+        rich_help_panel="Streaming Options",
+    ),
+    stage_workers: Optional[str] = typer.Option(
+        None,
+        "--stage-workers",
+        show_default=False,
+        callback=stage_workers_callback,
+        help="[Optional] Workers per streaming stage, e.g. 'load=4,preprocess=2,describe=2'",
+        rich_help_panel="Streaming Options",
+    ),
+    queue_size: int = typer.Option(
+        8,
+        "--queue-size",
+        min=1,
+        help="[Optional] Capacity of the queues between streaming stages, or per --workers worker",
+        rich_help_panel="Streaming Options",
+    ),
+    evaluate_index: bool = typer.Option(
+        False,
+        "--evaluate-index",
+        help="[Optional] Also run exact search and report the recall lost by the configured index",
+        rich_help_panel="Additional Options",
+    ),
+    evaluate_quantization: bool = typer.Option(
+        False,
+        "--evaluate-quantization",
+        help="[Optional] Also run with float64 descriptors and report the precision/recall deltas",
+        rich_help_panel="Additional Options",
+    ),
+    evaluate_keyframes: bool = typer.Option(
+        False,
+        "--evaluate-keyframes",
+        help="[Optional] Also insert every scan and report the precision/recall deltas",
+        rich_help_panel="Additional Options",
+    ),
+    track_memory: int = typer.Option(
+        0,
+        "--track-memory",
+        min=0,
+        help="[Optional] Sample RSS and the size of the growing structures every N scans",
+        rich_help_panel="Additional Options",
+    ),
+    distance_matrix: Optional[str] = typer.Option(
+        None,
+        "--distance-matrix",
+        show_default=False,
+        callback=matrix_dtype_callback,
+        help="[Optional] Also write every pairwise distance as a float16 or float32 matrix",
+        rich_help_panel="Offline Analysis Options",
+    ),
+    matrix_memory: int = typer.Option(
+        256,
+        "--matrix-memory",
+        min=1,
+        help="[Optional] Memory ceiling in MiB while computing and evaluating the matrix",
+        rich_help_panel="Offline Analysis Options",
+    ),
 ):
     # Lazy-loading for faster CLI
     from solid.datasets import dataset_factory
     from solid.pipeline import SolidPipeline
 
+    if streaming and stage_workers is None:
+        stage_workers = {}
+    if prefetch > 0 and workers > 1:
+        raise typer.BadParameter("--prefetch cannot read ahead for --workers processes")
+
+    dataset = dataset_factory(
+        dataloader=dataloader,
+        data_dir=data,
+        # Additional options
+        sequence=sequence,
+        prefetch=prefetch,
+    )
     SolidPipeline(
-        dataset=dataset_factory(
-            dataloader=dataloader,
-            data_dir=data,
-            # Additional options
-            sequence=sequence,
-        ),
+        dataset=dataset,
         results_dir=results_dir,
         config=config,
+        workers=workers,
+        cache_dir=cache_dir,
+        stage_workers=stage_workers,
+        queue_size=queue_size,
+        evaluate_index=evaluate_index,
+        track_memory=track_memory,
+        evaluate_quantization=evaluate_quantization,
+        evaluate_keyframes=evaluate_keyframes,
+        distance_matrix=distance_matrix,
+        matrix_memory=matrix_memory * 2**20,
     ).run().print()
+    if prefetch > 0:
+        dataset.print()
+        dataset.close()
 
 
 def run():
@@ -0,0 +1,175 @@
+# MIT License
+#
+# Copyright (c) 2023 Saurabh Gupta, Tiziano Guadagnino, Cyrill Stachniss.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+import hashlib
+import json
+import os
+
+try:
+    import fcntl
+except ImportError:
+    # No advisory locks on this platform, concurrent runs must not share a cache directory
+    fcntl = None
+from pathlib import Path
+from typing import List, Tuple
+
+import numpy as np
+
+from solid.config import SolidConfig
+
+# Only these fields change the R-SOLiD/A-SOLiD of a scan
+DESCRIPTOR_FIELDS = (
+    "min_distance",
+    "max_distance",
+    "fov_u",
+    "fov_d",
+    "num_angle",
+    "num_elevation",
+    "num_range",
+    "voxel_size",
+)
+
+
+def scan_fingerprints(dataset) -> List[Tuple[str, int, int]]:
+    """(file name, mtime in ns, size) of every scan of the dataset, in dataset order"""
+    if hasattr(dataset, "fingerprints"):
+        # Packed archives carry the fingerprints of the files they were packed from
+        return [tuple(fingerprint) for fingerprint in dataset.fingerprints]
+    scans_dir = getattr(dataset, "scans_dir", None) or getattr(dataset, "scan_folder", "")
+    fingerprints = []
+    for scan_file in getattr(dataset, "scan_files", range(len(dataset))):
+        scan_file = str(scan_file)
+        path = scan_file if os.path.isabs(scan_file) else os.path.join(scans_dir, scan_file)
+        try:
+            stat = os.stat(path)
+            fingerprints.append((os.path.basename(scan_file), stat.st_mtime_ns, stat.st_size))
+        except FileNotFoundError:
+            fingerprints.append((os.path.basename(scan_file), 0, 0))
+    return fingerprints
+
+
+class DescriptorCache:
+    """On-disk store of the descriptors of one sequence for one descriptor configuration.
+
+    Descriptors are appended as raw float64 rows to rsolid.bin/asolid.bin and read back as
+    memory-mapped arrays. manifest.json records the scans they were computed from, so scans that
+    were appended to the sequence after the cache was written are the only ones to recompute.
+
+    A process holds an exclusive lock on the directory from construction to close(), so runs that
+    share a cache wait for each other instead of interleaving their rows, then reuse them."""
+
+    def __init__(self, cache_dir: Path, dataset, config: SolidConfig, flush_every: int = 256):
+        descriptor_config = {field: getattr(config, field) for field in DESCRIPTOR_FIELDS}
+        key = hashlib.sha1(
+            json.dumps([dataset.sequence_id, descriptor_config], sort_keys=True).encode()
+        ).hexdigest()[:16]
+        self.cache_dir = os.path.join(cache_dir, f"{dataset.sequence_id}_{key}")
+        self._rsolid_file = os.path.join(self.cache_dir, "rsolid.bin")
+        self._asolid_file = os.path.join(self.cache_dir, "asolid.bin")
+        self._manifest_file = os.path.join(self.cache_dir, "manifest.json")
+
+        self._num_range = config.num_range
+        self._num_angle = config.num_angle
+        self._flush_every = flush_every
+        self._pending = []
+
+        self.manifest = {
+            "sequence_id": dataset.sequence_id,
+            "config": descriptor_config,
+            "scans": [],
+        }
+        self.fingerprints = [list(fingerprint) for fingerprint in scan_fingerprints(dataset)]
+        self._lock_file = self._lock()
+        self.num_cached = self._validate()
+
+    def _lock(self):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        lock_file = open(os.path.join(self.cache_dir, "lock"), "w")
+        if fcntl is not None:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        return lock_file
+
+    def close(self) -> None:
+        """Flushes the pending descriptors and lets other processes use the directory"""
+        if self._lock_file is None:
+            return
+        self.flush()
+        if fcntl is not None:
+            fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+        self._lock_file.close()
+        self._lock_file = None
+
+    def _validate(self) -> int:
+        if not os.path.exists(self._manifest_file):
+            self._truncate(0)
+            return 0
+        with open(self._manifest_file) as manifest_file:
+            manifest = json.load(manifest_file)
+
+        num_cached = 0
+        for cached, current in zip(manifest["scans"], self.fingerprints):
+            if cached != current:
+                break
+            num_cached += 1
+        # Drop everything after the first scan that changed on disk
+        self.manifest["scans"] = manifest["scans"][:num_cached]
+        self._truncate(num_cached)
+        return num_cached
+
+    def _truncate(self, num_rows: int) -> None:
+        files = ((self._rsolid_file, self._num_range), (self._asolid_file, self._num_angle))
+        for filename, dim in files:
+            if os.path.exists(filename):
+                os.truncate(filename, num_rows * dim * np.dtype(np.float64).itemsize)
+
+    def load(self) -> Tuple[np.ndarray, np.ndarray]:
+        if self.num_cached == 0:
+            return np.empty((0, self._num_range)), np.empty((0, self._num_angle))
+        rsolid = np.memmap(
+            self._rsolid_file, np.float64, "r", shape=(self.num_cached, self._num_range)
+        )
+        asolid = np.memmap(
+            self._asolid_file, np.float64, "r", shape=(self.num_cached, self._num_angle)
+        )
+        return rsolid, asolid
+
+    def append(self, r_solid: np.ndarray, a_solid: np.ndarray) -> None:
+        self._pending.append((r_solid, a_solid))
+        if len(self._pending) >= self._flush_every:
+            self.flush()
+
+    def flush(self) -> None:
+        if not self._pending:
+            return
+        os.makedirs(self.cache_dir, exist_ok=True)
+        r_solids, a_solids = zip(*self._pending)
+        with open(self._rsolid_file, "ab") as rsolid_file:
+            np.asarray(r_solids, dtype=np.float64).tofile(rsolid_file)
+        with open(self._asolid_file, "ab") as asolid_file:
+            np.asarray(a_solids, dtype=np.float64).tofile(asolid_file)
+
+        start = len(self.manifest["scans"])
+        self.manifest["scans"] = self.fingerprints[: start + len(self._pending)]
+        self._pending = []
+        tmp_file = self._manifest_file + ".tmp"
+        with open(tmp_file, "w") as manifest_file:
+            json.dump(self.manifest, manifest_file)
+        os.replace(tmp_file, self._manifest_file)
@@ -0,0 +1,354 @@
+# MIT License
+#
+# Copyright (c) 2023 Saurabh Gupta, Tiziano Guadagnino, Cyrill Stachniss.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+import json
+import mmap
+import os
+import struct
+import time
+from pathlib import Path
+from typing import Dict, Optional
+
+import numpy as np
+import typer
+from rich import box
+from rich.console import Console
+from rich.table import Table
+
+from solid.config import SolidConfig, load_config
+from solid.core.database import SolidDatabase
+from solid.core.index import top_k_smallest
+from solid.core.point_module import PointModule
+from solid.core.solid import SOLiDModule
+from solid.tools.descriptor_cache import DESCRIPTOR_FIELDS
+from solid.tools.progress_bar import get_progress_bar
+
+MAP_MAGIC = b"SOLIDMP1"
+MAP_VERSION = 1
+# Footer position, footer length, magic
+_TRAILER = struct.Struct("<QQ8s")
+_SESSION_ARRAYS = ("rsolid", "asolid", "scan_ids", "timestamps")
+
+
+class DescriptorMap:
+    """Descriptors of one or more sessions in a single append-only file.
+
+    Every session is a block of normalized R-SOLiD rows, A-SOLiD rows, scan ids and timestamps
+    (int64 in the units of the dataloader, e.g. microseconds for NCLT, -1 if unknown), followed
+    by a JSON footer describing all blocks and a fixed-size trailer. Appending a session writes
+    the new block, footer and trailer after the current trailer, so the previous footer stays
+    valid until the new one is complete; the old footer is left behind as a few dead bytes. Every
+    block is read back as a memory map, so a query only pages in the descriptors it touches."""
+
+    def __init__(self, filename: Path):
+        self.filename = str(filename)
+        with open(self.filename, "rb") as map_file:
+            self.footer = _read_footer(map_file)
+            if self.footer is None:
+                raise ValueError(f"{self.filename} is not a SOLiD descriptor map")
+        if self.footer["version"] != MAP_VERSION:
+            raise ValueError(f"Unsupported descriptor map version {self.footer['version']}")
+        self.config = self.footer["config"]
+        self.sessions = [self._map_session(session) for session in self.footer["sessions"]]
+
+    def _map_session(self, session: Dict) -> Dict[str, np.ndarray]:
+        num_scans = session["num_scans"]
+        shapes = {
+            "rsolid": (num_scans, self.config["num_range"]),
+            "asolid": (num_scans, self.config["num_angle"]),
+            "scan_ids": (num_scans,),
+            "timestamps": (num_scans,),
+        }
+        dtypes = {"rsolid": np.float64, "asolid": np.float64}
+        arrays = {"name": session["name"], "sequence_id": session["sequence_id"]}
+        for name in _SESSION_ARRAYS:
+            if num_scans == 0:
+                arrays[name] = np.empty(shapes[name], dtypes.get(name, np.int64))
+                continue
+            arrays[name] = np.memmap(
+                self.filename,
+                dtypes.get(name, np.int64),
+                "r",
+                offset=session["offsets"][name],
+                shape=shapes[name],
+            )
+        return arrays
+
+    def __len__(self):
+        return sum(len(session["scan_ids"]) for session in self.sessions)
+
+    @staticmethod
+    def create(filename: Path, config: SolidConfig) -> "DescriptorMap":
+        footer = {
+            "version": MAP_VERSION,
+            "config": {field: getattr(config, field) for field in DESCRIPTOR_FIELDS},
+            "sessions": [],
+        }
+        with open(filename, "wb") as map_file:
+            _write_footer(map_file, footer)
+        return DescriptorMap(filename)
+
+    def append_session(
+        self, name: str, sequence_id: str, rsolid, asolid, scan_ids, timestamps
+    ) -> None:
+        if name in (session["name"] for session in self.footer["sessions"]):
+            raise ValueError(f"The map already has a session named '{name}'")
+        arrays = {
+            "rsolid": np.ascontiguousarray(SolidDatabase.normalize(rsolid), dtype=np.float64),
+            "asolid": np.ascontiguousarray(asolid, dtype=np.float64),
+            "scan_ids": np.ascontiguousarray(scan_ids, dtype=np.int64),
+            "timestamps": np.ascontiguousarray(timestamps, dtype=np.int64),
+        }
+        session = {"name": name, "sequence_id": sequence_id, "num_scans": len(scan_ids)}
+        session["offsets"] = {}
+        footer = {**self.footer, "sessions": self.footer["sessions"] + [session]}
+        with open(self.filename, "r+b") as map_file:
+            end = map_file.seek(0, os.SEEK_END)
+            try:
+                for array_name in _SESSION_ARRAYS:
+                    session["offsets"][array_name] = map_file.tell()
+                    arrays[array_name].tofile(map_file)
+                # The block must be on disk before a trailer can point at it
+                map_file.flush()
+                os.fsync(map_file.fileno())
+                _write_footer(map_file, footer)
+                map_file.flush()
+                os.fsync(map_file.fileno())
+            except BaseException:
+                # Interrupted: drop the partial block, the previous trailer ends the file again
+                map_file.truncate(end)
+                raise
+        self.footer = footer
+        self.sessions.append(self._map_session(session))
+
+
+def _read_footer(map_file) -> Optional[Dict]:
+    """Footer of the last intact trailer. That is the one at the end of the file, unless an
+    append was killed before it could remove its partial block"""
+    if os.fstat(map_file.fileno()).st_size < _TRAILER.size:
+        return None
+    with mmap.mmap(map_file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        return _find_footer(data)
+
+
+def _find_footer(data) -> Optional[Dict]:
+    end = len(data)
+    while True:
+        magic_offset = data.rfind(MAP_MAGIC, 0, end)
+        if magic_offset < 0:
+            return None
+        end = magic_offset + len(MAP_MAGIC) - 1
+        trailer_offset = magic_offset + len(MAP_MAGIC) - _TRAILER.size
+        if trailer_offset < 0:
+            continue
+        footer_offset, footer_length, _ = _TRAILER.unpack_from(data, trailer_offset)
+        if footer_offset + footer_length != trailer_offset:
+            continue
+        try:
+            return json.loads(data[footer_offset:trailer_offset])
+        except ValueError:
+            continue
+
+
+def _write_footer(map_file, footer: Dict) -> int:
+    footer_offset = map_file.tell()
+    footer_bytes = json.dumps(footer).encode()
+    map_file.write(footer_bytes)
+    map_file.write(_TRAILER.pack(footer_offset, len(footer_bytes), MAP_MAGIC))
+    return footer_offset
+
+
+def _check_config(descriptor_map: DescriptorMap, config: SolidConfig) -> None:
+    for field in DESCRIPTOR_FIELDS:
+        if descriptor_map.config[field] != getattr(config, field):
+            raise ValueError(
+                f"{field} is {getattr(config, field)} but the map was built with "
+                f"{descriptor_map.config[field]}, descriptors would not be comparable"
+            )
+
+
+def _timestamps(dataset) -> np.ndarray:
+    timestamps = getattr(dataset, "timestamps", None)
+    if timestamps is None:
+        return np.full(len(dataset), -1, dtype=np.int64)
+    return np.asarray(timestamps, dtype=np.int64)
+
+
+def build_map(
+    dataset, map_file: Path, config: SolidConfig, session: Optional[str] = None
+) -> DescriptorMap:
+    """Adds the descriptors of every scan of the dataset to map_file as a new session"""
+    # Lazy-loading, the pipeline is not needed to read a map
+    from solid.pipeline import compute_descriptor
+    from solid.tools.timing import StageTimings
+
+    session = session or dataset.sequence_id
+    if os.path.exists(map_file):
+        descriptor_map = DescriptorMap(map_file)
+        _check_config(descriptor_map, config)
+        if any(existing["name"] == session for existing in descriptor_map.sessions):
+            raise ValueError(f"The map already has a session named '{session}'")
+    else:
+        descriptor_map = DescriptorMap.create(map_file, config)
+
+    preprocess, solid, timings = PointModule(config), SOLiDModule(config), StageTimings()
+    rsolid = np.empty((len(dataset), config.num_range))
+    asolid = np.empty((len(dataset), config.num_angle))
+    for idx in get_progress_bar(0, len(dataset)):
+        rsolid[idx], asolid[idx] = compute_descriptor(dataset[idx], preprocess, solid, timings)
+    descriptor_map.append_session(
+        session,
+        dataset.sequence_id,
+        rsolid,
+        asolid,
+        np.arange(len(dataset)),
+        _timestamps(dataset),
+    )
+    return descriptor_map
+
+
+def query_map(dataset, descriptor_map: DescriptorMap, config: SolidConfig) -> np.ndarray:
+    """Cross-session closures of every scan of the dataset against the map, one row
+    [session idx, map scan id, query idx, yaw in degrees, cosine distance] per closure"""
+    _check_config(descriptor_map, config)
+    preprocess, solid = PointModule(config), SOLiDModule(config)
+    closures = []
+    for query_idx in get_progress_bar(0, len(dataset)):
+        scan_downsampled = preprocess.filter_and_down_sampling(dataset[query_idx])
+        query_R_solid, query_A_solid = solid.get_descriptor(scan_downsampled)
+        query_R_solid = SolidDatabase.normalize(query_R_solid)
+
+        session_ids, positions, distances = [], [], []
+        for session_idx, session in enumerate(descriptor_map.sessions):
+            cosdist = 1 - session["rsolid"] @ query_R_solid
+            hits = np.flatnonzero(cosdist < config.loop_threshold)
+            session_ids.append(np.full(len(hits), session_idx))
+            positions.append(hits)
+            distances.append(cosdist[hits])
+        distances = np.concatenate(distances) if distances else np.empty(0)
+        if not len(distances):
+            continue
+        session_ids, positions = np.concatenate(session_ids), np.concatenate(positions)
+        if config.top_k is not None:
+            best = top_k_smallest(distances, config.top_k)
+            session_ids, positions, distances = session_ids[best], positions[best], distances[best]
+
+        sessions = descriptor_map.sessions
+        candidate_A_solids = np.array(
+            [sessions[s]["asolid"][position] for s, position in zip(session_ids, positions)]
+        )
+        angle_differences = solid.pose_estimation_batch(
+            query_A_solid, candidate_A_solids, mode=config.yaw_mode
+        )
+        for session_idx, position, angle, cosdist in zip(
+            session_ids, positions, angle_differences, distances
+        ):
+            scan_id = sessions[session_idx]["scan_ids"][position]
+            closures.append([session_idx, scan_id, query_idx, angle, cosdist])
+    return np.array(closures).reshape(-1, 5)
+
+
+def _rich_table_sessions(
+    descriptor_map: DescriptorMap, closures=None, table_format: box.Box = box.HORIZONTALS
+) -> Table:
+    name = os.path.basename(descriptor_map.filename)
+    size = os.path.getsize(descriptor_map.filename) / 2**20
+    table = Table(box=table_format, title=f"Descriptor map {name}")
+    table.caption = f"{len(descriptor_map)} scans, {size:.1f} MiB"
+    table.add_column("Session", justify="center", style="cyan")
+    table.add_column("Sequence", justify="center", style="magenta")
+    table.add_column("Scans", justify="center", style="magenta")
+    if closures is not None:
+        table.add_column("Closures", justify="left", style="green")
+        table.add_column("Localized queries", justify="left", style="green")
+    for session_idx, session in enumerate(descriptor_map.sessions):
+        row = [session["name"], session["sequence_id"], f"{len(session['scan_ids'])}"]
+        if closures is not None:
+            matched = closures[closures[:, 0] == session_idx]
+            row += [f"{len(matched)}", f"{len(np.unique(matched[:, 2]))}"]
+        table.add_row(*row)
+    return table
+
+
+app = typer.Typer(add_completion=False, rich_markup_mode="rich")
+
+
+@app.command("build", help="Add the descriptors of a sequence to a map, creating it if needed")
+def build(
+    data: Path = typer.Argument(..., help="The data directory of the sequence", show_default=False),
+    map_file: Path = typer.Argument(..., help="The map to create or extend", show_default=False),
+    dataloader: str = typer.Option(..., show_default=False, help="Dataloader of the sequence"),
+    sequence: Optional[str] = typer.Option(
+        None, "--sequence", "-s", show_default=False, help="[Optional] Sequence of the dataloader"
+    ),
+    config: Optional[Path] = typer.Option(
+        None, "--config", exists=True, show_default=False, help="[Optional] Configuration file"
+    ),
+    session: Optional[str] = typer.Option(
+        None,
+        "--session",
+        show_default=False,
+        help="[Optional] Session name, the sequence id by default",
+    ),
+):
+    # Lazy-loading for faster CLI
+    from solid.datasets import dataset_factory
+
+    dataset = dataset_factory(dataloader=dataloader, data_dir=data, sequence=sequence)
+    descriptor_map = build_map(dataset, map_file, load_config(config), session)
+    Console().print(_rich_table_sessions(descriptor_map))
+
+
+@app.command("query", help="Localize every scan of a sequence against a map")
+def query(
+    data: Path = typer.Argument(..., help="The data directory of the sequence", show_default=False),
+    map_file: Path = typer.Argument(..., exists=True, help="The map", show_default=False),
+    results_dir: Path = typer.Argument(..., help="Where closures are stored", show_default=False),
+    dataloader: str = typer.Option(..., show_default=False, help="Dataloader of the sequence"),
+    sequence: Optional[str] = typer.Option(
+        None, "--sequence", "-s", show_default=False, help="[Optional] Sequence of the dataloader"
+    ),
+    config: Optional[Path] = typer.Option(
+        None, "--config", exists=True, show_default=False, help="[Optional] Configuration file"
+    ),
+):
+    # Lazy-loading for faster CLI
+    from solid.datasets import dataset_factory
+
+    dataset = dataset_factory(dataloader=dataloader, data_dir=data, sequence=sequence)
+    descriptor_map = DescriptorMap(map_file)
+    start = time.perf_counter()
+    closures = query_map(dataset, descriptor_map, load_config(config))
+    elapsed = time.perf_counter() - start
+
+    os.makedirs(results_dir, exist_ok=True)
+    np.savetxt(
+        os.path.join(results_dir, f"{dataset.sequence_id}_cross_session_closures.txt"),
+        closures,
+        fmt="%d %d %d %.2f %.6f",
+        header="session map_scan_id query_idx yaw_deg cosine_distance",
+    )
+    Console().print(_rich_table_sessions(descriptor_map, closures))
+    Console().print(f"{len(dataset)} queries in {elapsed:.2f} s")
+
+
+def run():
+    app()
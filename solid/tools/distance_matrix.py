@@ -0,0 +1,170 @@
+# MIT License
+#
+# Copyright (c) 2023 Saurabh Gupta, Tiziano Guadagnino, Cyrill Stachniss.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import List, Optional
+
+import numpy as np
+import typer
+
+MATRIX_VERSION = 1
+MATRIX_DTYPES = ("float16", "float32")
+
+
+def _row_offset(row):
+    """Position of (row, 0) in the packed strictly lower triangle, row by row"""
+    return row * (row - 1) // 2
+
+
+class DistanceMatrix:
+    """Cosine distances between all pairs of scans, stored as the packed strictly lower triangle
+    of the N x N matrix in a raw float16/float32 file: row i holds d(i, j) for every j < i.
+    Metadata lives in a JSON file next to it."""
+
+    def __init__(self, filename: Path):
+        self.filename = str(filename)
+        with open(self.filename + ".json") as meta_file:
+            self.meta = json.load(meta_file)
+        if self.meta["version"] != MATRIX_VERSION:
+            raise ValueError(f"Unsupported distance matrix version {self.meta['version']}")
+        self.num_scans = self.meta["num_scans"]
+        num_entries = _row_offset(self.num_scans)
+        self.values = np.memmap(
+            self.filename, np.dtype(self.meta["dtype"]), "r", shape=(max(num_entries, 1),)
+        )[:num_entries]
+
+    def row(self, row: int) -> np.ndarray:
+        return self.values[_row_offset(row) : _row_offset(row + 1)]
+
+    def rows(self, start: int, stop: int) -> np.ndarray:
+        """Packed entries of rows start to stop, row after row"""
+        return self.values[_row_offset(start) : _row_offset(stop)]
+
+    def __getitem__(self, pairs):
+        rows, cols = (np.asarray(indices, dtype=np.int64) for indices in pairs)
+        return self.values[_row_offset(rows) + cols]
+
+
+def tile_size(num_scans: int, max_memory: int, workers: int) -> int:
+    # Every worker holds a float64 product tile plus its converted copy
+    size = int(np.sqrt(max_memory / (workers * (8 + 4))))
+    return int(np.clip(size, 64, max(num_scans, 64)))
+
+
+def compute_distance_matrix(
+    rsolid: np.ndarray,
+    filename: Path,
+    dtype: str = "float32",
+    max_memory: int = 256 * 2**20,
+    workers: Optional[int] = None,
+) -> DistanceMatrix:
+    """Writes the pairwise cosine distances of L2-normalized R-SOLiD rows into filename.
+
+    The triangle is split into square tiles sized to keep the tiles in flight under max_memory.
+    Every tile is one BLAS matrix product, and the products run on a thread pool since BLAS
+    releases the GIL. Finished tiles are written straight into the memory-mapped file."""
+    if dtype not in MATRIX_DTYPES:
+        raise ValueError(f"Unsupported distance matrix dtype '{dtype}', use float16 or float32")
+    rsolid = np.ascontiguousarray(rsolid, dtype=np.float64)
+    num_scans = len(rsolid)
+    workers = workers or min(os.cpu_count() or 1, 8)
+    size = tile_size(num_scans, max_memory, workers)
+
+    num_entries = _row_offset(num_scans)
+    with open(filename, "wb") as matrix_file:
+        matrix_file.truncate(num_entries * np.dtype(dtype).itemsize)
+    values = np.memmap(filename, dtype, "r+", shape=(max(num_entries, 1),))
+
+    def compute_tile(rows: slice, cols: slice) -> None:
+        tile = (1 - rsolid[rows] @ rsolid[cols].T).astype(dtype)
+        for tile_row, row in enumerate(range(rows.start, rows.stop)):
+            stop = min(cols.stop, row)
+            if stop > cols.start:
+                offset = _row_offset(row)
+                values[offset + cols.start : offset + stop] = tile[tile_row, : stop - cols.start]
+
+    starts = range(0, num_scans, size)
+    with ThreadPoolExecutor(workers, thread_name_prefix="distance-matrix") as executor:
+        tiles = [
+            executor.submit(
+                compute_tile,
+                slice(row_start, min(row_start + size, num_scans)),
+                slice(col_start, min(col_start + size, num_scans)),
+            )
+            for row_start in starts
+            for col_start in starts
+            if col_start <= row_start
+        ]
+        for tile in tiles:
+            tile.result()
+    values.flush()
+    del values
+
+    with open(f"{filename}.json", "w") as meta_file:
+        json.dump(
+            {"version": MATRIX_VERSION, "num_scans": num_scans, "dtype": dtype, "layout": "tril"},
+            meta_file,
+        )
+    return DistanceMatrix(filename)
+
+
+app = typer.Typer(add_completion=False, rich_markup_mode="rich")
+
+
+@app.command("evaluate", help="Precision/recall of a distance matrix for any thresholds")
+def evaluate(
+    matrix: Path = typer.Argument(..., exists=True, help="Distance matrix file"),
+    gt_closures: Path = typer.Argument(..., exists=True, help="Ground truth closures, N x 2"),
+    thresholds: List[float] = typer.Option(
+        [0.004, 0.008, 0.012, 0.016, 0.02], "--threshold", "-t", help="Distance thresholds"
+    ),
+    exclusion_frames: int = typer.Option(
+        100, "--exclusion-frames", min=0, help="Pairs closer in time are never closures"
+    ),
+    exclusion_seconds: Optional[float] = typer.Option(
+        None, "--exclusion-seconds", min=0, help="Pairs closer in time are never closures"
+    ),
+    timestamps: Optional[Path] = typer.Option(
+        None, "--timestamps", exists=True, help="Scan timestamps in seconds, one per line"
+    ),
+    max_memory: int = typer.Option(256, "--max-memory", min=1, help="Memory ceiling in MiB"),
+):
+    from solid.tools.pipeline_results import PipelineResults
+
+    if exclusion_seconds is not None and timestamps is None:
+        raise typer.BadParameter("--exclusion-seconds needs --timestamps")
+    distance_matrix = DistanceMatrix(matrix)
+    results = PipelineResults(np.loadtxt(gt_closures), os.path.basename(matrix), thresholds)
+    results.compute_metrics_from_matrix(
+        distance_matrix,
+        exclusion_frames,
+        max_memory * 2**20,
+        times=np.loadtxt(timestamps, ndmin=1) if timestamps is not None else None,
+        exclusion_seconds=exclusion_seconds,
+    )
+    results.log_to_console()
+
+
+def run():
+    app()
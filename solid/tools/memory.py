@@ -0,0 +1,125 @@
+# MIT License
+#
+# Copyright (c) 2023 Saurabh Gupta, Tiziano Guadagnino, Cyrill Stachniss.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+import json
+import os
+import resource
+import sys
+from typing import Dict, List
+
+import numpy as np
+from rich import box
+from rich.console import Console
+from rich.table import Table
+
+
+def current_rss() -> int:
+    """Resident set size of this process in bytes"""
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return peak_rss()
+
+
+def peak_rss() -> int:
+    """Peak resident set size of this process in bytes"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+class MemoryTracker:
+    """Samples the resident memory and the size of the structures that grow with the sequence
+    every `every` scans. A linear fit over the samples gives the growth in bytes per scan, from
+    which the footprint of a longer sequence can be projected before running it."""
+
+    def __init__(self, every: int = 100):
+        self.every = max(every, 1)
+        self.scans: List[int] = []
+        self.samples: Dict[str, List[int]] = {"rss": []}
+
+    def due(self, num_scans: int) -> bool:
+        return num_scans % self.every == 0
+
+    def sample(self, num_scans: int, structures: Dict[str, int]) -> None:
+        if self.scans and self.scans[-1] == num_scans:
+            return
+        self.scans.append(num_scans)
+        self.samples["rss"].append(current_rss())
+        for name, nbytes in structures.items():
+            self.samples.setdefault(name, []).append(int(nbytes))
+
+    def growth(self) -> Dict[str, float]:
+        """Bytes per scan of every tracked quantity, from a least-squares line over the samples"""
+        if len(self.scans) < 2:
+            return {name: 0.0 for name in self.samples}
+        return {
+            name: float(np.polyfit(self.scans, values, 1)[0])
+            for name, values in self.samples.items()
+        }
+
+    def projected_bytes(self, num_scans: int) -> Dict[str, float]:
+        if not self.scans:
+            return {name: 0.0 for name in self.samples}
+        growth = self.growth()
+        return {
+            name: values[-1] + growth[name] * (num_scans - self.scans[-1])
+            for name, values in self.samples.items()
+        }
+
+    def _rich_table_memory(self, title: str, table_format: box.Box = box.HORIZONTALS) -> Table:
+        table = Table(box=table_format, title=title)
+        table.caption = (
+            f"{len(self.scans)} samples over {self.scans[-1] if self.scans else 0} scans, "
+            f"peak RSS {peak_rss() / 2**20:.1f} MiB"
+        )
+        table.add_column("Structure", justify="center", style="cyan")
+        table.add_column("Final (MiB)", justify="center", style="magenta")
+        table.add_column("Growth (bytes/scan)", justify="left", style="green")
+        table.add_column("Projected @ 100k scans (MiB)", justify="left", style="green")
+        growth = self.growth()
+        projected = self.projected_bytes(100000)
+        for name, values in self.samples.items():
+            table.add_row(
+                name,
+                f"{values[-1] / 2**20:.2f}" if values else "-",
+                f"{growth[name]:.1f}",
+                f"{projected[name] / 2**20:.1f}" if values else "-",
+            )
+        return table
+
+    def log_to_console(self, title: str = "Memory") -> None:
+        Console().print(self._rich_table_memory(title))
+
+    def log_to_file(self, filename: str) -> None:
+        with open(filename, "w") as trace_file:
+            json.dump(
+                {
+                    "every": self.every,
+                    "peak_rss": peak_rss(),
+                    "bytes_per_scan": self.growth(),
+                    "scans": self.scans,
+                    "samples": self.samples,
+                },
+                trace_file,
+                indent=2,
+            )
@@ -0,0 +1,78 @@
+# MIT License
+#
+# Copyright (c) 2023 Saurabh Gupta, Tiziano Guadagnino, Cyrill Stachniss.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+import importlib
+import os
+from pathlib import Path
+from typing import Optional
+
+import typer
+
+from solid.datasets import available_dataloaders
+from solid.tools.cmd import name_callback
+
+app = typer.Typer(add_completion=False, rich_markup_mode="rich")
+
+
+@app.command(help="Pack the scans of a sequence into one archive that solid_pipeline picks up")
+def solid_pack(
+    data: Path = typer.Argument(
+        ..., help="The data directory used by the specified dataloader", show_default=False
+    ),
+    dataloader: str = typer.Option(
+        ...,
+        show_default=False,
+        case_sensitive=False,
+        autocompletion=available_dataloaders,
+        callback=name_callback,
+        help="The dataloader the scans are read with",
+    ),
+    sequence: Optional[str] = typer.Option(
+        None, "--sequence", "-s", show_default=False, help="[Optional] Sequence of the dataloader"
+    ),
+    output: Optional[Path] = typer.Option(
+        None,
+        "--output",
+        "-o",
+        show_default=False,
+        help="[Optional] Archive to write, by default next to the scans where it is picked up",
+    ),
+    dtype: str = typer.Option(
+        "float64", "--dtype", help="[Optional] float64 keeps results identical, float32 halves size"
+    ),
+):
+    # Lazy-loading for faster CLI
+    from solid.datasets import dataloader_types
+    from solid.datasets.packed import pack_dataset, packed_archive_path
+
+    if dtype not in ("float32", "float64"):
+        raise typer.BadParameter("Use float32 or float64")
+    # Bypass dataset_factory, which would pick up an archive that is already there
+    module = importlib.import_module(f"solid.datasets.{dataloader}")
+    dataset = getattr(module, dataloader_types()[dataloader])(data_dir=data, sequence=sequence)
+    output = output or packed_archive_path(data, sequence)
+    pack_dataset(dataset, str(output), dtype)
+    size = os.path.getsize(output) / 2**20
+    typer.echo(f"Packed {len(dataset)} scans into {output} ({size:.1f} MiB)")
+
+
+def run():
+    app()
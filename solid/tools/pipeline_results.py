@@ -19,14 +19,18 @@
 # LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
+import json
 import os
-from typing import Dict, Set, Tuple
+from typing import Dict, List, Optional, Tuple
 
 import numpy as np
 from rich import box
 from rich.console import Console
 from rich.table import Table
 
+from solid.core.exclusion import num_candidates
+from solid.core.index import top_k_smallest
+
 
 class Metrics:
     def __init__(self, true_positives, false_positives, false_negatives):
@@ -50,43 +54,298 @@ class Metrics:
             self.F1 = np.nan
 
 
+def metrics_to_dict(metrics: Dict[float, Metrics]) -> Dict[str, Dict[str, float]]:
+    """JSON-friendly metrics, keyed by the threshold as printed in the tables"""
+    return {
+        f"{threshold:.4f}": {
+            "tp": metric.tp,
+            "fp": metric.fp,
+            "fn": metric.fn,
+            "precision": metric.precision,
+            "recall": metric.recall,
+            "f1": metric.F1,
+        }
+        for threshold, metric in metrics.items()
+    }
+
+
+def add_best_f1_columns(table: Table) -> None:
+    table.add_column("SOLiD Threshold", justify="center", style="magenta")
+    table.add_column("Precision", justify="left", style="green")
+    table.add_column("Recall", justify="left", style="green")
+    table.add_column("F1 score", justify="left", style="green")
+
+
+def best_f1_cells(metrics: Dict[str, Dict[str, float]]) -> List[str]:
+    """Cells of the add_best_f1_columns columns for metrics_to_dict metrics"""
+    # NaN F1 scores, e.g. without predictions, never compare equal
+    scored = [
+        (threshold, metric) for threshold, metric in metrics.items() if metric["f1"] == metric["f1"]
+    ]
+    if not scored:
+        return ["-", "-", "-", "-"]
+    threshold, metric = max(scored, key=lambda item: item[1]["f1"])
+    return [
+        threshold,
+        f"{metric['precision']:.4f}",
+        f"{metric['recall']:.4f}",
+        f"{metric['f1']:.4f}",
+    ]
+
+
+def pair_keys(indices_a: np.ndarray, indices_b: np.ndarray) -> np.ndarray:
+    """Order-independent int64 key for every (a, b) scan index pair"""
+    indices_a = np.asarray(indices_a, dtype=np.int64)
+    indices_b = np.asarray(indices_b, dtype=np.int64)
+    return (np.minimum(indices_a, indices_b) << 32) | np.maximum(indices_a, indices_b)
+
+
+class DistanceLog:
+    """Append-only log of (query idx, candidate idx, distance) columns in fixed size chunks"""
+
+    def __init__(self, chunk_size: int = 1 << 20) -> None:
+        self._chunk_size = chunk_size
+        self._chunks = []
+        self._fill = 0
+
+    def __len__(self) -> int:
+        return max(len(self._chunks) - 1, 0) * self._chunk_size + self._fill
+
+    @property
+    def nbytes(self) -> int:
+        return sum(column.nbytes for chunk in self._chunks for column in chunk)
+
+    def _new_chunk(self) -> None:
+        self._chunks.append(
+            (
+                np.empty(self._chunk_size, dtype=np.int32),
+                np.empty(self._chunk_size, dtype=np.int32),
+                np.empty(self._chunk_size, dtype=np.float32),
+            )
+        )
+        self._fill = 0
+
+    def append(self, query_idx: int, nn_indices: np.ndarray, distances: np.ndarray) -> None:
+        start = 0
+        while start < len(nn_indices):
+            if not self._chunks or self._fill == self._chunk_size:
+                self._new_chunk()
+            queries, candidates, dists = self._chunks[-1]
+            stop = min(len(nn_indices), start + self._chunk_size - self._fill)
+            chunk_slice = slice(self._fill, self._fill + stop - start)
+            queries[chunk_slice] = query_idx
+            candidates[chunk_slice] = nn_indices[start:stop]
+            dists[chunk_slice] = distances[start:stop]
+            self._fill += stop - start
+            start = stop
+
+    def arrays(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        if not self._chunks:
+            return (
+                np.empty(0, dtype=np.int32),
+                np.empty(0, dtype=np.int32),
+                np.empty(0, dtype=np.float32),
+            )
+        chunks = self._chunks[:-1] + [tuple(column[: self._fill] for column in self._chunks[-1])]
+        return tuple(np.concatenate(columns) for columns in zip(*chunks))
+
+
+class RetrievalComparison:
+    """Accumulates, per threshold, how many of the closures found by exact search an approximate
+    retrieval also returned, and the time both of them took. With top_k, exact search only keeps
+    its k best candidates as well"""
+
+    def __init__(self, name: str, solid_thresholds, top_k: Optional[int] = None) -> None:
+        self.name = name
+        self._solid_thresholds = np.asarray(solid_thresholds)
+        self._top_k = top_k
+        self.exact_closures = np.zeros(len(self._solid_thresholds), dtype=np.int64)
+        self.found_closures = np.zeros(len(self._solid_thresholds), dtype=np.int64)
+        self.exact_time = 0.0
+        self.approximate_time = 0.0
+        self.queries = 0
+
+    def append(
+        self,
+        exact_distances: np.ndarray,
+        retrieved_ids: np.ndarray,
+        exact_time: float,
+        approximate_time: float,
+    ) -> None:
+        thresholds = self._solid_thresholds
+        exact_best = exact_distances[top_k_smallest(exact_distances, self._top_k)]
+        self.exact_closures += np.searchsorted(exact_best, thresholds)
+        self.found_closures += np.searchsorted(np.sort(exact_distances[retrieved_ids]), thresholds)
+        self.exact_time += exact_time
+        self.approximate_time += approximate_time
+        self.queries += 1
+
+    def recall(self) -> np.ndarray:
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return self.found_closures / self.exact_closures
+
+    def speedup(self) -> float:
+        return self.exact_time / self.approximate_time if self.approximate_time > 0 else np.nan
+
+    def _rich_table(self, table_format: box.Box = box.HORIZONTALS) -> Table:
+        table = Table(box=table_format, title=self.name)
+        table.caption = (
+            f"{self.queries} queries, exact {self.exact_time:.2f} s, "
+            f"approximate {self.approximate_time:.2f} s, speedup {self.speedup():.2f}x"
+        )
+        table.add_column("SOLiD Threshold", justify="center", style="cyan")
+        table.add_column("Exact closures", justify="center", style="magenta")
+        table.add_column("Retrieved closures", justify="center", style="magenta")
+        table.add_column("Recall vs exact", justify="left", style="green")
+        for threshold, exact, found, recall in zip(
+            self._solid_thresholds, self.exact_closures, self.found_closures, self.recall()
+        ):
+            table.add_row(f"{threshold:.4f}", f"{exact}", f"{found}", f"{recall:.4f}")
+        return table
+
+    def log_to_console(self) -> None:
+        Console().print(self._rich_table())
+
+    def log_to_file(self, filename) -> None:
+        with open(filename, "w") as logfile:
+            json.dump(
+                {
+                    "name": self.name,
+                    "queries": self.queries,
+                    "exact_time_s": self.exact_time,
+                    "approximate_time_s": self.approximate_time,
+                    "speedup": self.speedup(),
+                    "thresholds": self._solid_thresholds.tolist(),
+                    "exact_closures": self.exact_closures.tolist(),
+                    "retrieved_closures": self.found_closures.tolist(),
+                    "recall": self.recall().tolist(),
+                },
+                logfile,
+                indent=2,
+            )
+
+
 class PipelineResults:
-    def __init__(self, gt_closures: np.ndarray, dataset_name: str, solid_thresholds) -> None:
+    def __init__(
+        self,
+        gt_closures: np.ndarray,
+        dataset_name: str,
+        solid_thresholds,
+        top_k: Optional[int] = None,
+    ) -> None:
         self._dataset_name = dataset_name
-        self._solid_thresholds = solid_thresholds
+        self._solid_thresholds = np.asarray(solid_thresholds)
+        # With top_k, only the k best candidates of every query are logged and evaluated
+        self._top_k = top_k
 
-        self.predicted_closures: Dict[float, Set[Tuple[int]]] = {}
-        for threshold in self._solid_thresholds:
-            self.predicted_closures[threshold] = set()
+        self.distance_log = DistanceLog()
 
         self.metrics: Dict[float, Metrics] = {}
+        self.timings = None
 
-        gt_closures = gt_closures if gt_closures.shape[1] == 2 else gt_closures.T
-        self.gt_closures: Set[Tuple[int]] = set(map(lambda x: tuple(sorted(x)), gt_closures))
+        if gt_closures is not None:
+            gt_closures = gt_closures if gt_closures.shape[1] == 2 else gt_closures.T
+            self.gt_closures = np.unique(pair_keys(gt_closures[:, 0], gt_closures[:, 1]))
+        else:
+            self.gt_closures = np.empty(0, dtype=np.int64)
 
     def print(self) -> None:
         if self.metrics:
             self.log_to_console()
+        if self.timings is not None and self.timings.counts:
+            self.log_timings_to_console()
 
-    def append(self, query_idx: int, nn_idx: int, dist: float) -> None:
-        indices = np.where(dist < self._solid_thresholds)[0]
-        for index in indices:
-            self.predicted_closures[self._solid_thresholds[index]].add((nn_idx, query_idx))
+    def append(self, query_idx: int, nn_indices: np.ndarray, distances: np.ndarray) -> None:
+        # Pairs at or above the largest threshold never count as a predicted closure
+        mask = distances < self._solid_thresholds.max()
+        self.distance_log.append(query_idx, nn_indices[mask], distances[mask])
 
     def compute_metrics(
         self,
     ) -> None:
-        for key in self._solid_thresholds:
-            closures = self.predicted_closures[key]
-            closures = set(map(lambda x: tuple(sorted(x)), closures))
-            tp = len(self.gt_closures.intersection(closures))
-            fp = len(closures) - tp
+        queries, candidates, distances = self.distance_log.arrays()
+        order = np.argsort(distances, kind="stable")
+        distances = distances[order]
+        keys = pair_keys(candidates[order], queries[order])
+
+        # A pair counts once, at its smallest distance
+        _, first = np.unique(keys, return_index=True)
+        is_first = np.zeros(len(keys), dtype=bool)
+        is_first[first] = True
+        predicted = np.cumsum(is_first)
+        true_positives = np.cumsum(is_first & np.isin(keys, self.gt_closures))
+
+        num_predicted = np.searchsorted(distances, self._solid_thresholds, side="left")
+        for key, count in zip(self._solid_thresholds, num_predicted):
+            tp = int(true_positives[count - 1]) if count else 0
+            fp = int(predicted[count - 1]) - tp if count else 0
             fn = len(self.gt_closures) - tp
             self.metrics[key] = Metrics(tp, fp, fn)
 
+    def compute_metrics_from_matrix(
+        self,
+        distance_matrix,
+        exclusion_frames: int,
+        max_memory: int = 256 * 2**20,
+        times: Optional[np.ndarray] = None,
+        exclusion_seconds: Optional[float] = None,
+    ) -> None:
+        """Metrics of exhaustive retrieval read from a DistanceMatrix file: every pair (i, j) with
+        i - j > exclusion_frames and a distance below the threshold is a predicted closure. With
+        exclusion_seconds, j must also be at least that many seconds older than i, times are the
+        scan timestamps in seconds.
+
+        The matrix is read in blocks of rows holding at most max_memory bytes of working arrays,
+        so any threshold or exclusion window can be evaluated without rerunning the pipeline."""
+        order = np.argsort(self._solid_thresholds)
+        thresholds = self._solid_thresholds[order]
+
+        def counts_below(distances):
+            # Number of distances strictly below every (sorted) threshold
+            bins = np.searchsorted(thresholds, distances, side="right")
+            return np.cumsum(np.bincount(bins, minlength=len(thresholds) + 1))[:-1]
+
+        num_scans = distance_matrix.num_scans
+        # Number of leading columns of every row that are old enough to be candidates
+        row_candidates = num_candidates(
+            np.arange(num_scans), exclusion_frames, exclusion_seconds, times=times
+        )
+
+        # Bytes per entry of the largest working arrays alive at once: the int64 arange and
+        # repeat building the boolean mask, then the mask, the selected values and their int64
+        # threshold bins
+        itemsize = distance_matrix.values.itemsize
+        block_entries = max(max_memory // (2 * itemsize + 17), 1)
+        predicted = np.zeros(len(thresholds), dtype=np.int64)
+        start = exclusion_frames + 1
+        while start < num_scans:
+            # Largest stop with stop * (stop - 1) / 2 <= start * (start - 1) / 2 + block_entries
+            stop = int((1 + np.sqrt(1 + 4 * start * (start - 1) + 8 * block_entries)) // 2)
+            stop = min(max(stop, start + 1), num_scans)
+            rows = np.arange(start, stop)
+            offsets = np.cumsum(rows) - rows
+            eligible = np.arange(rows.sum()) < np.repeat(offsets + row_candidates[rows], rows)
+            predicted += counts_below(distance_matrix.rows(start, stop)[eligible])
+            del eligible
+            start = stop
+
+        gt_rows = (self.gt_closures & 0xFFFFFFFF).astype(np.int64)
+        gt_cols = (self.gt_closures >> 32).astype(np.int64)
+        eligible = gt_rows < num_scans
+        eligible[eligible] = gt_cols[eligible] < row_candidates[gt_rows[eligible]]
+        true_positives = counts_below(distance_matrix[gt_rows[eligible], gt_cols[eligible]])
+
+        self.metrics = {}
+        for key, count, tp in zip(thresholds, predicted, true_positives):
+            tp = int(tp)
+            self.metrics[key] = Metrics(tp, int(count) - tp, len(self.gt_closures) - tp)
+        self.metrics = {key: self.metrics[key] for key in self._solid_thresholds}
+
     def _rich_table_pr(self, table_format: box.Box = box.HORIZONTALS) -> Table:
         table = Table(box=table_format, title=self._dataset_name)
         table.caption = f"Loop Closure Distance Threshold:"
+        if self._top_k is not None:
+            table.caption += f" (top-{self._top_k} candidates per query)"
         table.add_column("SOLiD Threshold", justify="center", style="cyan")
         table.add_column("True Positives", justify="center", style="magenta")
         table.add_column("False Positives", justify="center", style="magenta")
@@ -106,17 +365,100 @@ class PipelineResults:
             )
         return table
 
+    def _rich_table_timings(self, table_format: box.Box = box.HORIZONTALS) -> Table:
+        table = Table(box=table_format, title=f"{self._dataset_name} timings")
+        table.caption = "Latency percentiles are histogram bucket upper edges"
+        table.add_column("Stage", justify="center", style="cyan")
+        table.add_column("Calls", justify="center", style="magenta")
+        table.add_column("Total (s)", justify="center", style="magenta")
+        table.add_column("Mean (ms)", justify="left", style="green")
+        table.add_column("p50 (ms)", justify="left", style="green")
+        table.add_column("p95 (ms)", justify="left", style="green")
+        table.add_column("p99 (ms)", justify="left", style="green")
+        for stage, timing in self.timings.summary().items():
+            table.add_row(
+                stage,
+                f"{timing['calls']}",
+                f"{timing['total_s']:.3f}",
+                f"{timing['mean_s'] * 1e3:.3f}",
+                f"{timing['p50_s'] * 1e3:.3f}",
+                f"{timing['p95_s'] * 1e3:.3f}",
+                f"{timing['p99_s'] * 1e3:.3f}",
+            )
+        return table
+
+    def deltas(self, reference: "PipelineResults") -> Dict[float, Dict[str, float]]:
+        """Precision, recall and F1 score differences to the metrics of a reference run"""
+        return {
+            threshold: {
+                "precision": metric.precision,
+                "recall": metric.recall,
+                "f1": metric.F1,
+                "delta_precision": metric.precision - reference.metrics[threshold].precision,
+                "delta_recall": metric.recall - reference.metrics[threshold].recall,
+                "delta_f1": metric.F1 - reference.metrics[threshold].F1,
+            }
+            for threshold, metric in self.metrics.items()
+        }
+
+    def _rich_table_delta(
+        self,
+        reference: "PipelineResults",
+        title: str,
+        caption: str = "",
+        table_format: box.Box = box.HORIZONTALS,
+    ) -> Table:
+        table = Table(box=table_format, title=title)
+        table.caption = caption
+        table.add_column("SOLiD Threshold", justify="center", style="cyan")
+        table.add_column("Precision", justify="center", style="magenta")
+        table.add_column("Recall", justify="center", style="magenta")
+        table.add_column("F1 score", justify="center", style="magenta")
+        table.add_column("Δ Precision", justify="left", style="green")
+        table.add_column("Δ Recall", justify="left", style="green")
+        table.add_column("Δ F1 score", justify="left", style="green")
+        for threshold, delta in self.deltas(reference).items():
+            table.add_row(
+                f"{threshold:.4f}",
+                f"{delta['precision']:.4f}",
+                f"{delta['recall']:.4f}",
+                f"{delta['f1']:.4f}",
+                f"{delta['delta_precision']:+.4f}",
+                f"{delta['delta_recall']:+.4f}",
+                f"{delta['delta_f1']:+.4f}",
+            )
+        return table
+
     def log_to_console(self) -> None:
         console = Console()
         console.print(self._rich_table_pr())
 
+    def log_delta_to_console(self, reference: "PipelineResults", title: str, caption: str = ""):
+        Console().print(self._rich_table_delta(reference, title, caption))
+
+    def log_delta_to_file(self, reference: "PipelineResults", filename) -> None:
+        with open(filename, "w") as delta_file:
+            json.dump(
+                {f"{threshold:.4f}": delta for threshold, delta in self.deltas(reference).items()},
+                delta_file,
+                indent=2,
+            )
+
+    def log_timings_to_console(self) -> None:
+        console = Console()
+        console.print(self._rich_table_timings())
+
     def log_to_file_pr(self, filename) -> None:
         with open(filename, "wt") as logfile:
             console = Console(file=logfile, width=100, force_jupyter=False)
             console.print(self._rich_table_pr(table_format=box.ASCII_DOUBLE_HEAD))
 
     def log_to_file_closures(self, result_dir) -> None:
-        np.save(
-            os.path.join(result_dir, f"predicted_closures.npy"),
-            self.predicted_closures,
+        queries, candidates, distances = self.distance_log.arrays()
+        np.savez(
+            os.path.join(result_dir, f"predicted_closures.npz"),
+            query_idx=queries,
+            candidate_idx=candidates,
+            distance=distances,
+            thresholds=self._solid_thresholds,
         )
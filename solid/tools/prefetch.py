@@ -0,0 +1,136 @@
+# MIT License
+#
+# Copyright (c) 2023 Saurabh Gupta, Tiziano Guadagnino, Cyrill Stachniss.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional
+
+from rich import box
+from rich.console import Console
+from rich.table import Table
+
+
+class PrefetchDataset:
+    """Wraps any dataloader and reads the next `depth` scans on background threads.
+
+    Access is expected to be mostly sequential; any other index is read synchronously and
+    restarts the read-ahead window from there. Time spent waiting inside __getitem__ is accounted
+    as blocked on I/O, time between two __getitem__ calls as compute. Several threads may call
+    __getitem__ at once, e.g. streaming load workers."""
+
+    def __init__(self, dataset, depth: int = 4, num_threads: Optional[int] = None):
+        self._dataset = dataset
+        self.depth = max(depth, 1)
+        self.num_threads = num_threads or min(self.depth, 8)
+
+        self._executor = None
+        self._pid = None
+        self._pending: "OrderedDict[int, object]" = OrderedDict()
+        # Guards the read-ahead window and the counters, not the reads themselves
+        self._lock = threading.Lock()
+
+        self.num_scans = 0
+        self.io_time = 0.0
+        self.compute_time = 0.0
+        self._last_return = None
+
+    def __getattr__(self, name):
+        # Only called for attributes not found on the wrapper: sequence_id, gt_closure_indices, ...
+        if name == "_dataset":
+            raise AttributeError(name)
+        return getattr(self._dataset, name)
+
+    def __len__(self):
+        return len(self._dataset)
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        # Threads do not survive a fork, so a forked process needs its own pool
+        if self._pid != os.getpid():
+            self._executor = ThreadPoolExecutor(self.num_threads, thread_name_prefix="prefetch")
+            self._pending = OrderedDict()
+            self._pid = os.getpid()
+        return self._executor
+
+    def _schedule(self, start: int) -> None:
+        executor = self._get_executor()
+        for idx in range(start, min(start + self.depth, len(self._dataset))):
+            if idx not in self._pending:
+                self._pending[idx] = executor.submit(self._dataset.__getitem__, idx)
+
+    def __getitem__(self, idx):
+        entry = time.perf_counter()
+        with self._lock:
+            if self._last_return is not None:
+                self.compute_time += max(entry - self._last_return, 0.0)
+
+            self._get_executor()
+            future = self._pending.pop(idx, None)
+            # Drop read-ahead that fell behind the requested index
+            for stale in [pending for pending in self._pending if pending < idx]:
+                self._pending.pop(stale).cancel()
+            self._schedule(idx + 1)
+        scan = future.result() if future is not None else self._dataset[idx]
+
+        with self._lock:
+            self._last_return = time.perf_counter()
+            self.io_time += self._last_return - entry
+            self.num_scans += 1
+        return scan
+
+    def close(self) -> None:
+        with self._lock:
+            for future in self._pending.values():
+                future.cancel()
+            self._pending.clear()
+            executor, self._executor, self._pid = self._executor, None, None
+        if executor is not None:
+            executor.shutdown(wait=True)
+
+    def io_stats(self) -> Dict[str, float]:
+        total = self.io_time + self.compute_time
+        return {
+            "scans": self.num_scans,
+            "depth": self.depth,
+            "blocked_on_io_s": self.io_time,
+            "compute_s": self.compute_time,
+            "blocked_fraction": self.io_time / total if total > 0 else 0.0,
+        }
+
+    def _rich_table_io(self, table_format: box.Box = box.HORIZONTALS) -> Table:
+        stats = self.io_stats()
+        table = Table(box=table_format, title=f"Prefetching (depth {self.depth})")
+        table.add_column("Scans", justify="center", style="cyan")
+        table.add_column("Blocked on I/O (s)", justify="center", style="magenta")
+        table.add_column("Compute (s)", justify="center", style="magenta")
+        table.add_column("Blocked fraction", justify="left", style="green")
+        table.add_row(
+            f"{stats['scans']}",
+            f"{stats['blocked_on_io_s']:.2f}",
+            f"{stats['compute_s']:.2f}",
+            f"{stats['blocked_fraction']:.2%}",
+        )
+        return table
+
+    def print(self) -> None:
+        Console().print(self._rich_table_io())
@@ -0,0 +1,211 @@
+# MIT License
+#
+# Copyright (c) 2023 Saurabh Gupta, Tiziano Guadagnino, Cyrill Stachniss.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+import json
+import queue
+import threading
+import time
+from typing import Callable, Dict, Iterable, List
+
+from rich import box
+from rich.console import Console
+from rich.table import Table
+
+_END = object()
+
+
+class Stage:
+    """One step of a StreamingEngine: `fn` applied by `workers` threads to every item.
+
+    Ordered stages see the items in the order the source produced them, whatever the order in
+    which the upstream workers finished."""
+
+    def __init__(self, name: str, fn: Callable, workers: int = 1, ordered: bool = False):
+        self.name = name
+        self.fn = fn
+        self.workers = max(workers, 1)
+        self.ordered = ordered
+        if self.ordered and self.workers != 1:
+            raise ValueError(f"Ordered stage '{name}' must run on a single worker")
+
+        self.items = 0
+        self.busy_time = 0.0
+        self.queue_samples = 0
+        self.queue_occupancy = 0
+        self.queue_max = 0
+        self._lock = threading.Lock()
+
+    def _record(self, busy_time: float, queue_size: int) -> None:
+        with self._lock:
+            self.items += 1
+            self.busy_time += busy_time
+            self.queue_samples += 1
+            self.queue_occupancy += queue_size
+            self.queue_max = max(self.queue_max, queue_size)
+
+
+class StreamingEngine:
+    """Runs a chain of stages connected by bounded queues.
+
+    A stage blocks as soon as the queue to its successor is full, so the number of items in
+    flight, and with it the memory they hold, is bounded by the queue sizes whatever the length
+    of the source."""
+
+    def __init__(self, stages: List[Stage], queue_size: int = 8):
+        self.stages = stages
+        self.queue_size = queue_size
+        self.wall_time = 0.0
+        self._stop = threading.Event()
+        self._errors = []
+
+    def _put(self, out_queue: queue.Queue, item) -> bool:
+        while not self._stop.is_set():
+            try:
+                out_queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _get(self, in_queue: queue.Queue):
+        while not self._stop.is_set():
+            try:
+                return in_queue.get(timeout=0.1)
+            except queue.Empty:
+                continue
+        return _END
+
+    def _worker(self, stage: Stage, in_queue, out_queue, finished: List[int]) -> None:
+        reorder_buffer: Dict[int, object] = {}
+        next_seq = 0
+        try:
+            while True:
+                queue_size = in_queue.qsize()
+                item = self._get(in_queue)
+                if item is _END:
+                    # Let the other workers of this stage see the end of the stream as well
+                    self._put(in_queue, _END)
+                    break
+                seq, payload = item
+                if stage.ordered:
+                    reorder_buffer[seq] = payload
+                    ready = []
+                    while next_seq in reorder_buffer:
+                        ready.append((next_seq, reorder_buffer.pop(next_seq)))
+                        next_seq += 1
+                else:
+                    ready = [(seq, payload)]
+                for seq, payload in ready:
+                    start = time.perf_counter()
+                    result = stage.fn(payload)
+                    stage._record(time.perf_counter() - start, queue_size)
+                    if out_queue is not None and not self._put(out_queue, (seq, result)):
+                        return
+        except Exception as error:
+            self._errors.append(error)
+            self._stop.set()
+        finally:
+            with stage._lock:
+                finished[0] += 1
+                last = finished[0] == stage.workers
+            if last and out_queue is not None:
+                self._put(out_queue, _END)
+
+    def run(self, source: Iterable) -> None:
+        queues = [queue.Queue(maxsize=self.queue_size) for _ in self.stages]
+        threads = []
+        for stage_idx, stage in enumerate(self.stages):
+            out_queue = queues[stage_idx + 1] if stage_idx + 1 < len(self.stages) else None
+            finished = [0]
+            for worker_idx in range(stage.workers):
+                thread = threading.Thread(
+                    target=self._worker,
+                    args=(stage, queues[stage_idx], out_queue, finished),
+                    name=f"{stage.name}-{worker_idx}",
+                    daemon=True,
+                )
+                threads.append(thread)
+
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for seq, item in enumerate(source):
+            if not self._put(queues[0], (seq, item)):
+                break
+        self._put(queues[0], _END)
+        for thread in threads:
+            thread.join()
+        self.wall_time = time.perf_counter() - start
+
+        if self._errors:
+            raise self._errors[0]
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        stats = {}
+        for stage in self.stages:
+            stats[stage.name] = {
+                "workers": stage.workers,
+                "items": stage.items,
+                "busy_s": stage.busy_time,
+                "throughput_hz": stage.items / self.wall_time if self.wall_time > 0 else 0.0,
+                # Fraction of the run the stage's workers were busy; the bottleneck is close to 1
+                "utilization": (
+                    stage.busy_time / (stage.workers * self.wall_time)
+                    if self.wall_time > 0
+                    else 0.0
+                ),
+                "mean_queue": (
+                    stage.queue_occupancy / stage.queue_samples if stage.queue_samples else 0.0
+                ),
+                "max_queue": stage.queue_max,
+            }
+        return stats
+
+    def _rich_table_stages(self, title: str, table_format: box.Box = box.HORIZONTALS) -> Table:
+        table = Table(box=table_format, title=title)
+        table.caption = f"Queue size: {self.queue_size}, wall time: {self.wall_time:.2f} s"
+        table.add_column("Stage", justify="center", style="cyan")
+        table.add_column("Workers", justify="center", style="magenta")
+        table.add_column("Items", justify="center", style="magenta")
+        table.add_column("Throughput (Hz)", justify="center", style="magenta")
+        table.add_column("Utilization", justify="left", style="green")
+        table.add_column("Mean queue", justify="left", style="green")
+        table.add_column("Max queue", justify="left", style="green")
+        for name, stage in self.stats().items():
+            table.add_row(
+                name,
+                f"{stage['workers']}",
+                f"{stage['items']}",
+                f"{stage['throughput_hz']:.2f}",
+                f"{stage['utilization']:.2%}",
+                f"{stage['mean_queue']:.2f}",
+                f"{stage['max_queue']}",
+            )
+        return table
+
+    def log_to_console(self, title: str = "Streaming stages") -> None:
+        Console().print(self._rich_table_stages(title))
+
+    def log_to_file(self, filename: str) -> None:
+        stats = {"queue_size": self.queue_size, "wall_time_s": self.wall_time}
+        stats["stages"] = self.stats()
+        with open(filename, "w") as stats_file:
+            json.dump(stats, stats_file, indent=2)
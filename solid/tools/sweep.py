@@ -0,0 +1,386 @@
+# MIT License
+#
+# Copyright (c) 2023 Saurabh Gupta, Tiziano Guadagnino, Cyrill Stachniss.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+import csv
+import hashlib
+import itertools
+import json
+import os
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import typer
+from rich import box
+from rich.console import Console
+from rich.table import Table
+
+from solid.config import SolidConfig, load_config
+from solid.core.database import SolidDatabase
+from solid.core.exclusion import num_candidates
+from solid.core.index import make_index
+from solid.core.point_module import PointModule
+from solid.core.solid import SOLiDModule
+from solid.datasets import scan_times
+from solid.tools.descriptor_cache import DESCRIPTOR_FIELDS, scan_fingerprints
+from solid.tools.pipeline_results import (
+    PipelineResults,
+    add_best_f1_columns,
+    best_f1_cells,
+    metrics_to_dict,
+)
+from solid.tools.progress_bar import get_progress_bar
+from solid.tools.timing import StageTimings
+
+# Only these fields change the downsampled clouds, and with them the polar coordinates
+PREPROCESS_FIELDS = ("min_distance", "max_distance", "voxel_size")
+
+
+def parse_grid(params: List[str]) -> Dict[str, List[str]]:
+    """{"num_angle": ["40", "60"], ...} from ["num_angle=40,60", ...]"""
+    grid = {}
+    for param in params:
+        name, _, values = param.partition("=")
+        name = name.strip()
+        if name not in SolidConfig.model_fields or not values.strip():
+            raise ValueError(
+                f"Use e.g. 'num_angle=40,60,80' with a SolidConfig field, not '{param}'"
+            )
+        grid[name] = [value.strip() for value in values.split(",")]
+    return grid
+
+
+def expand_grid(base: SolidConfig, grid: Dict[str, List[str]]) -> List[SolidConfig]:
+    """Every combination of the grid on top of base, grouped by preprocessing and descriptor
+    parameters so that consecutive combinations share as many stages as possible"""
+    names = list(grid)
+    configs = [
+        SolidConfig(**{**base.model_dump(), **dict(zip(names, values))})
+        for values in itertools.product(*grid.values())
+    ]
+    return sorted(
+        configs,
+        key=lambda config: (
+            stage_key(config, PREPROCESS_FIELDS),
+            stage_key(config, DESCRIPTOR_FIELDS),
+        ),
+    )
+
+
+def stage_key(config: SolidConfig, fields: Tuple[str, ...]) -> str:
+    return json.dumps({field: getattr(config, field) for field in fields}, sort_keys=True)
+
+
+class PolarClouds:
+    """Polar coordinates (theta, planar range, elevation) of the downsampled points of every
+    scan, concatenated in one (N, 3) array with per-scan offsets.
+
+    Re-binning them is all that is left to compute a descriptor for another bin layout or field
+    of view. With a cache_dir every scan is appended to coordinates.bin there as soon as it is
+    preprocessed, and the file is memory-mapped back, so the clouds never sit in memory. A
+    complete directory is reused by later sweeps as long as the scans did not change on disk."""
+
+    def __init__(self, cache_dir: Optional[str] = None):
+        self.cache_dir = cache_dir
+        self.coordinates = None
+        self.offsets = None
+        self._chunks = []
+        self._sizes = []
+        self._file = None
+        if cache_dir is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+            # Drop the manifest first, a sweep interrupted from here on leaves no valid cache
+            if os.path.exists(os.path.join(cache_dir, "manifest.json")):
+                os.remove(os.path.join(cache_dir, "manifest.json"))
+            self._file = open(os.path.join(cache_dir, "coordinates.bin"), "wb")
+
+    @classmethod
+    def load(cls, cache_dir: str, fingerprints: List) -> Optional["PolarClouds"]:
+        """The clouds cached in cache_dir, or None unless they were computed from these scans"""
+        try:
+            with open(os.path.join(cache_dir, "manifest.json")) as manifest_file:
+                manifest = json.load(manifest_file)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+        if manifest["fingerprints"] != [list(fingerprint) for fingerprint in fingerprints]:
+            return None
+        clouds = cls()
+        clouds.cache_dir = cache_dir
+        clouds.offsets = np.load(os.path.join(cache_dir, "offsets.npy"))
+        clouds._map()
+        return clouds
+
+    def _map(self) -> None:
+        num_points = int(self.offsets[-1])
+        self.coordinates = np.memmap(
+            os.path.join(self.cache_dir, "coordinates.bin"),
+            np.float64,
+            "r",
+            shape=(max(num_points, 1), 3),
+        )[:num_points]
+
+    def append(self, theta, faraway, elevation) -> None:
+        coordinates = np.stack((theta, faraway, elevation), axis=1)
+        self._sizes.append(len(coordinates))
+        if self._file is not None:
+            coordinates.tofile(self._file)
+        else:
+            self._chunks.append(coordinates)
+
+    def finalize(self, fingerprints: Optional[List] = None) -> None:
+        self.offsets = np.cumsum([0] + self._sizes)
+        self._sizes = []
+        if self._file is None:
+            self.coordinates = np.concatenate(self._chunks) if self._chunks else np.empty((0, 3))
+            self._chunks = []
+            return
+        self._file.close()
+        self._file = None
+        np.save(os.path.join(self.cache_dir, "offsets.npy"), self.offsets)
+        # Written last: only complete directories have a manifest
+        tmp_file = os.path.join(self.cache_dir, "manifest.json.tmp")
+        fingerprints = [list(fingerprint) for fingerprint in fingerprints]
+        with open(tmp_file, "w") as manifest_file:
+            json.dump({"fingerprints": fingerprints}, manifest_file)
+        os.replace(tmp_file, os.path.join(self.cache_dir, "manifest.json"))
+        self._map()
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, idx):
+        return self.coordinates[self.offsets[idx] : self.offsets[idx + 1]].T
+
+
+def preprocess_dataset(
+    dataset, configs: List[SolidConfig], timings: StageTimings, cache_dir: Optional[Path] = None
+) -> Dict[str, PolarClouds]:
+    """Loads every scan once and keeps its polar coordinates for every preprocessing variant
+    that is not already cached"""
+    variants = {}
+    for config in configs:
+        variants.setdefault(stage_key(config, PREPROCESS_FIELDS), config)
+    # The polar coordinates themselves do not depend on the descriptor parameters
+    solid = SOLiDModule(next(iter(variants.values())))
+
+    clouds = {}
+    fingerprints = scan_fingerprints(dataset) if cache_dir is not None else None
+    for key in variants:
+        if cache_dir is None:
+            clouds[key] = PolarClouds()
+            continue
+        digest = hashlib.sha1(f"{dataset.sequence_id}{key}".encode()).hexdigest()[:16]
+        variant_dir = os.path.join(cache_dir, f"{dataset.sequence_id}_polar_{digest}")
+        clouds[key] = PolarClouds.load(variant_dir, fingerprints) or PolarClouds(variant_dir)
+    preprocess = {
+        key: PointModule(config)
+        for key, config in variants.items()
+        if clouds[key].offsets is None
+    }
+    if not preprocess:
+        return clouds
+
+    for idx in get_progress_bar(0, len(dataset)):
+        start = timings.now()
+        scan = dataset[idx]
+        start = timings.record("load", start)
+        for key, point_module in preprocess.items():
+            scan_downsampled = point_module.filter_and_down_sampling(scan)
+            start = timings.record("preprocess", start)
+            clouds[key].append(*solid.polar_coordinates(scan_downsampled))
+            start = timings.record("polar_coordinates", start)
+
+    for key in preprocess:
+        clouds[key].finalize(fingerprints)
+    return clouds
+
+
+def compute_descriptors(
+    clouds: PolarClouds, config: SolidConfig, timings: StageTimings
+) -> Tuple[np.ndarray, np.ndarray]:
+    solid = SOLiDModule(config)
+    rsolids = np.empty((len(clouds), config.num_range))
+    asolids = np.empty((len(clouds), config.num_angle))
+    for idx in range(len(clouds)):
+        start = timings.now()
+        rsolids[idx], asolids[idx] = solid.polar2solid(*clouds[idx])
+        timings.record("descriptor", start)
+    return rsolids, asolids
+
+
+def evaluate(
+    rsolids: np.ndarray,
+    asolids: np.ndarray,
+    config: SolidConfig,
+    gt_closures,
+    dataset_name: str,
+    timings: StageTimings,
+    times: Optional[np.ndarray] = None,
+) -> PipelineResults:
+    """Same retrieval and metrics as SolidPipeline on precomputed descriptors, times are the scan
+    timestamps in seconds that config.exclusion_seconds needs"""
+    database = SolidDatabase(
+        config.num_range,
+        config.num_angle,
+        capacity=len(rsolids),
+        index=make_index(config),
+        dtype=config.descriptor_dtype,
+    )
+    database.extend(rsolids, asolids)
+    solid_thresholds = np.arange(config.loop_threshold, 0.04, 0.004)
+    results = PipelineResults(gt_closures, dataset_name, solid_thresholds, top_k=config.top_k)
+    for query_idx in range(len(database)):
+        max_scan_idx = int(
+            num_candidates(
+                query_idx, config.exclusion_frames, config.exclusion_seconds, times=times
+            )
+        )
+        if max_scan_idx <= 0:
+            continue
+        start = timings.now()
+        candidate_ids, cosdist = database.search(
+            database.rsolid[query_idx], max_scan_idx, k=config.top_k
+        )
+        results.append(query_idx, candidate_ids, cosdist)
+        timings.record("retrieval", start)
+    if gt_closures is not None:
+        results.compute_metrics()
+    return results
+
+
+def run_sweep(
+    dataset,
+    base: SolidConfig,
+    grid: Dict[str, List[str]],
+    results_dir: Path,
+    cache_dir: Optional[Path] = None,
+) -> List[Dict]:
+    configs = expand_grid(base, grid)
+    times = None
+    if any(config.exclusion_seconds is not None for config in configs):
+        times = scan_times(dataset)
+        if times is None:
+            raise ValueError(
+                "exclusion_seconds needs a dataloader with timestamps, use exclusion_frames"
+            )
+    timings = StageTimings()
+    console = Console()
+    console.print(f"Sweeping {len(configs)} combinations of {', '.join(grid)}")
+    clouds = preprocess_dataset(dataset, configs, timings, cache_dir)
+
+    report = []
+    descriptor_key, descriptors = None, None
+    for config in configs:
+        # Descriptors are only recomputed when a parameter they depend on changed
+        if stage_key(config, DESCRIPTOR_FIELDS) != descriptor_key:
+            descriptor_key = stage_key(config, DESCRIPTOR_FIELDS)
+            descriptors = compute_descriptors(
+                clouds[stage_key(config, PREPROCESS_FIELDS)], config, timings
+            )
+        results = evaluate(
+            *descriptors, config, dataset.gt_closure_indices, dataset.sequence_id, timings, times
+        )
+        report.append(
+            {
+                "params": {name: getattr(config, name) for name in grid},
+                "metrics": metrics_to_dict(results.metrics),
+            }
+        )
+
+    os.makedirs(results_dir, exist_ok=True)
+    write_report(report, list(grid), os.path.join(results_dir, "sweep.csv"))
+    timings.log_to_file(os.path.join(results_dir, "sweep_timings.json"))
+    console.print(_rich_table_sweep(report, list(grid), dataset.sequence_id))
+    return report
+
+
+def write_report(report: List[Dict], names: List[str], filename: str) -> None:
+    """One CSV row per combination and threshold"""
+    with open(filename, "w", newline="") as report_file:
+        writer = csv.writer(report_file)
+        writer.writerow(names + ["threshold", "tp", "fp", "fn", "precision", "recall", "f1"])
+        for entry in report:
+            params = [entry["params"][name] for name in names]
+            for threshold, metric in entry["metrics"].items():
+                writer.writerow(
+                    params
+                    + [threshold]
+                    + [metric[key] for key in ("tp", "fp", "fn", "precision", "recall", "f1")]
+                )
+
+
+def _rich_table_sweep(
+    report: List[Dict], names: List[str], dataset_name: str, table_format: box.Box = box.HORIZONTALS
+) -> Table:
+    table = Table(box=table_format, title=f"{dataset_name} parameter sweep")
+    table.caption = "Metrics at the threshold with the best F1 score of every combination"
+    for name in names:
+        table.add_column(name, justify="center", style="cyan")
+    add_best_f1_columns(table)
+    for entry in report:
+        row = [f"{entry['params'][name]}" for name in names]
+        table.add_row(*row, *best_f1_cells(entry["metrics"]))
+    return table
+
+
+app = typer.Typer(add_completion=False, rich_markup_mode="rich")
+
+
+@app.command(help="Evaluate every combination of a parameter grid, loading each scan only once")
+def solid_sweep(
+    data: Path = typer.Argument(
+        ..., help="The data directory used by the specified dataloader", show_default=False
+    ),
+    results_dir: Path = typer.Argument(
+        ..., help="Where sweep.csv is stored", show_default=False
+    ),
+    dataloader: str = typer.Option(
+        ..., show_default=False, help="Use a specific dataloader from those supported"
+    ),
+    params: List[str] = typer.Option(
+        ..., "--param", "-p", help="Values to sweep, e.g. 'num_angle=40,60,80', repeatable"
+    ),
+    config: Optional[Path] = typer.Option(
+        None, "--config", exists=True, show_default=False, help="[Optional] Base configuration"
+    ),
+    sequence: Optional[str] = typer.Option(
+        None, "--sequence", "-s", show_default=False, help="[Optional] Sequence of the dataloader"
+    ),
+    cache_dir: Optional[Path] = typer.Option(
+        None,
+        "--cache-dir",
+        show_default=False,
+        help="[Optional] Keep the preprocessed clouds on disk instead of in memory, and reuse them",
+    ),
+):
+    # Lazy-loading for faster CLI
+    from solid.datasets import dataset_factory
+
+    try:
+        grid = parse_grid(params)
+    except ValueError as error:
+        raise typer.BadParameter(str(error))
+    dataset = dataset_factory(dataloader=dataloader, data_dir=data, sequence=sequence)
+    run_sweep(dataset, load_config(config), grid, results_dir, cache_dir)
+
+
+def run():
+    app()
@@ -0,0 +1,120 @@
+# MIT License
+#
+# Copyright (c) 2023 Saurabh Gupta, Tiziano Guadagnino, Cyrill Stachniss.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+import bisect
+import json
+import threading
+import time
+from typing import Dict
+
+import numpy as np
+
+# Log-spaced histogram bucket edges from 1 us to 100 s, ten per decade, in nanoseconds
+_BUCKET_EDGES_NS = [int(10 ** (3 + decade / 10)) for decade in range(81)]
+
+
+class StageTimings:
+    """Per-stage totals and fixed-size latency histograms for hot-path instrumentation.
+
+    Recording a sample is a bisect into a short list plus a few integer additions, so the timings
+    can stay enabled in production runs and their memory does not grow with the run length."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.totals_ns: Dict[str, int] = {}
+        self.counts: Dict[str, int] = {}
+        self.histograms: Dict[str, np.ndarray] = {}
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["_lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def now() -> int:
+        return time.perf_counter_ns()
+
+    def record(self, stage: str, start_ns: int) -> int:
+        """Accounts the time since start_ns to stage and returns the current time"""
+        stop_ns = time.perf_counter_ns()
+        self.add(stage, stop_ns - start_ns)
+        return stop_ns
+
+    def add(self, stage: str, duration_ns: int) -> None:
+        bucket = bisect.bisect_left(_BUCKET_EDGES_NS, duration_ns)
+        with self._lock:
+            if stage not in self.counts:
+                self.totals_ns[stage] = 0
+                self.counts[stage] = 0
+                self.histograms[stage] = np.zeros(len(_BUCKET_EDGES_NS) + 1, dtype=np.int64)
+            self.totals_ns[stage] += duration_ns
+            self.counts[stage] += 1
+            self.histograms[stage][bucket] += 1
+
+    def merge(self, other: "StageTimings") -> None:
+        for stage, count in other.counts.items():
+            with self._lock:
+                if stage not in self.counts:
+                    self.totals_ns[stage] = 0
+                    self.counts[stage] = 0
+                    self.histograms[stage] = np.zeros(len(_BUCKET_EDGES_NS) + 1, dtype=np.int64)
+                self.totals_ns[stage] += other.totals_ns[stage]
+                self.counts[stage] += count
+                self.histograms[stage] += other.histograms[stage]
+
+    def percentile(self, stage: str, q: float) -> float:
+        """Upper edge, in seconds, of the histogram bucket that holds the q-th percentile"""
+        cumulative = np.cumsum(self.histograms[stage])
+        bucket = int(np.searchsorted(cumulative, q / 100 * cumulative[-1]))
+        edges = _BUCKET_EDGES_NS + [_BUCKET_EDGES_NS[-1] * 10]
+        return edges[bucket] * 1e-9
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        summary = {}
+        for stage, count in self.counts.items():
+            total = self.totals_ns[stage] * 1e-9
+            summary[stage] = {
+                "calls": count,
+                "total_s": total,
+                "mean_s": total / count,
+                "p50_s": self.percentile(stage, 50),
+                "p95_s": self.percentile(stage, 95),
+                "p99_s": self.percentile(stage, 99),
+            }
+        return summary
+
+    def log_to_file(self, filename: str) -> None:
+        with open(filename, "w") as timings_file:
+            json.dump(
+                {
+                    "stages": self.summary(),
+                    "histogram_edges_s": [edge * 1e-9 for edge in _BUCKET_EDGES_NS],
+                    "histograms": {
+                        stage: histogram.tolist() for stage, histogram in self.histograms.items()
+                    },
+                },
+                timings_file,
+                indent=2,
+            )
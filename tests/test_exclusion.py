@@ -0,0 +1,14 @@
+import numpy as np
+
+from solid.core.exclusion import num_candidates
+
+
+def test_window_of_recent_timestamps_matches_full_sequence():
+    times = np.cumsum(np.random.default_rng(0).uniform(0.05, 0.15, 300))
+    expected = num_candidates(np.arange(300), 10, 2.0, times=times)
+    assert expected[20] == 0 and expected[-1] > 0
+    # Scans before first are old enough for every query, as OnlineSolid keeps them
+    for query_idx in range(40, 300):
+        first = int(expected[query_idx - 20])
+        window = times[first : query_idx + 1]
+        assert num_candidates(query_idx, 10, 2.0, times=window, first=first) == expected[query_idx]
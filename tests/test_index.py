@@ -0,0 +1,41 @@
+import numpy as np
+import pytest
+
+from solid.core.database import SolidDatabase
+from solid.core.index import IVFIndex, ProjectionIndex
+
+
+def _descriptors(num_scans=400, num_range=40, seed=0):
+    rng = np.random.default_rng(seed)
+    places = rng.random((50, num_range))
+    return places[rng.integers(0, len(places), num_scans)] + rng.normal(
+        scale=0.05, size=(num_scans, num_range)
+    )
+
+
+@pytest.mark.parametrize(
+    "make_index",
+    [
+        lambda: IVFIndex(num_lists=8, num_probes=2, train_size=100),
+        lambda: ProjectionIndex(dims=4, shortlist=32, train_size=100),
+    ],
+    ids=["ivf", "projection"],
+)
+def test_cold_and_warm_cache_search_alike(make_index):
+    rsolids = np.abs(_descriptors())
+    asolids = np.zeros((len(rsolids), 60))
+
+    # Cold cache: every scan is queried right after its insertion, like a serial pipeline run.
+    # Warm cache: every cached scan is inserted at once before the first query
+    cold = SolidDatabase(40, 60, index=make_index())
+    warm = SolidDatabase(40, 60, index=make_index())
+    warm.extend(rsolids, asolids)
+    for query_idx, (r_solid, a_solid) in enumerate(zip(rsolids, asolids)):
+        cold.append(r_solid, a_solid)
+        num_candidates = query_idx - 50
+        if num_candidates <= 0:
+            continue
+        cold_ids, cold_distances = cold.search(r_solid, num_candidates, k=10)
+        warm_ids, warm_distances = warm.search(r_solid, num_candidates, k=10)
+        np.testing.assert_array_equal(cold_ids, warm_ids)
+        np.testing.assert_array_equal(cold_distances, warm_distances)